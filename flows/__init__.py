@@ -6,6 +6,7 @@ from .basic import boolean
 from .basic import string
 
 from .input import file
+from .input import stream
 
 from .data import sql
 
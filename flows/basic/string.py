@@ -2,9 +2,6 @@
 Copyright (c) 2024 laffra - All Rights Reserved. 
 """
 
-packages = [ "duckdb" ]
-
-
 def string() -> str:
     """
     A constant string.
@@ -10,14 +10,14 @@ Copyright (c) 2024 laffra - All Rights Reserved.
 import pandas
 import duckdb
 
-packages = ["duckdb", "pandas", "fsspec"]
+packages = ["duckdb", "pandas", "fsspec", "pyarrow"]
 
 
 def query() -> duckdb.sql:
     """
-    A SQL query for DuckDB.
+    A SQL query for DuckDB, reading from the table named data.
     """
-    return "SELECT * FROM table"
+    return "SELECT * FROM data"
 
 
 def csv_table(csv: bytes) -> duckdb.table:
@@ -26,6 +26,44 @@ def csv_table(csv: bytes) -> duckdb.table:
     return duckdb.read_csv(csv)
 
 
+def sql_table(table: duckdb.table, sql: duckdb.sql) -> duckdb.table:
+    """ DuckDB + SQL => DuckDB, lazily. The SQL reads the table as data. """
+    import worker.database
+    return worker.database.bind(table, sql)
+
+
+def filter_table(table: duckdb.table, condition: str) -> duckdb.table:
+    """ DuckDB + WHERE condition => DuckDB, lazily """
+    return table.filter(condition)
+
+
+def select_columns(table: duckdb.table, columns: str) -> duckdb.table:
+    """ DuckDB + comma separated columns => DuckDB, lazily """
+    return table.project(columns)
+
+
+def limit_table(table: duckdb.table, rows: str) -> duckdb.table:
+    """ DuckDB + number of rows => DuckDB, lazily """
+    return table.limit(int(rows))
+
+
+def run_sql(sql: duckdb.sql) -> duckdb.table:
+    """
+    SQL => DuckDB, lazily. The outputs of other DuckDB and DataFrame
+    nodes can be read as views named after their node key.
+    """
+    import worker.database
+    return worker.database.query(sql)
+
+
+def join_tables(left: duckdb.table, right: duckdb.table, condition: str) -> duckdb.table:
+    """
+    DuckDB + DuckDB + condition => DuckDB, joined lazily inside DuckDB.
+    The condition refers to the inputs as left_table and right_table.
+    """
+    return left.set_alias("left_table").join(right.set_alias("right_table"), condition)
+
+
 def table_df(table: duckdb.table) -> pandas.DataFrame:
-    """ DuckDB -> Dataframe """
-    return table.df()
+    """ DuckDB -> Dataframe, runs the combined query of the upstream nodes """
+    return table.fetch_arrow_table().to_pandas(split_blocks=True, self_destruct=True)
@@ -10,7 +10,7 @@ import os
 
 import pandas
 
-packages = [ "fmpsdk", "plotly" ]
+packages = [ "pandas", "plotly" ]
 secrets = [
     (
         "FMPSDK",
@@ -20,13 +20,24 @@ secrets = [
     ),
 ]
 
-def quote(
+async def quote(
         symbol:str = ""
     ) -> dict:
     """ Return a quote for the given symbol """
-    import fmpsdk
+    import worker.fmp
 
-    return fmpsdk.quote(os.environ["FMPSDK"], symbol)
+    quotes = await worker.fmp.get_client(os.environ["FMPSDK"]).quotes([symbol])
+    return quotes[0] if quotes else {}
+
+
+async def quotes(
+        symbols:str = ""
+    ) -> pandas.DataFrame:
+    """ Return quotes for a comma-separated list of symbols, requested in batches """
+    import worker.fmp
+    import pandas
+
+    return pandas.DataFrame(await worker.fmp.get_client(os.environ["FMPSDK"]).quotes(symbols.split(",")))
 
 
 def history(
@@ -35,11 +46,10 @@ def history(
         to_date: str = ""
     ) -> pandas.DataFrame:
     """ Return historical prices for the given symbol """
-    import fmpsdk
+    import worker.fmp
     import pandas
 
-    return pandas.DataFrame(fmpsdk.historical_price_full(
-        os.environ["FMPSDK"],
+    return pandas.DataFrame(worker.fmp.get_client(os.environ["FMPSDK"]).history(
         symbol,
         from_date,
         to_date
@@ -5,8 +5,19 @@ Copyright (c) 2024 laffra - All Rights Reserved.
 
 def url_bytes(url: str) -> bytes:
     """
-    Load the contents of a file from a URL.
+    Load the contents of a file from a URL, cached on disk between runs.
     """
     import io # pylint: disable=import-outside-toplevel
-    import urllib.request # pylint: disable=import-outside-toplevel
-    return io.BytesIO(urllib.request.urlopen(url).read())
+    import worker.fetch # pylint: disable=import-outside-toplevel
+    return io.BytesIO(worker.fetch.fetch(url))
+
+
+async def urls_bytes(urls: str) -> list:
+    """
+    Load the contents of several files, one URL per line, requested
+    concurrently and cached on disk between runs.
+    """
+    import io # pylint: disable=import-outside-toplevel
+    import worker.fetch # pylint: disable=import-outside-toplevel
+    urls = [url.strip() for url in urls.splitlines() if url.strip()]
+    return [io.BytesIO(body) for body in await worker.fetch.fetch_all(urls)]
@@ -0,0 +1,37 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved. 
+"""
+
+# pylint: disable=import-outside-toplevel
+# pylint: disable=invalid-name
+
+import pandas
+import duckdb
+import worker.stream
+
+packages = ["pyarrow", "duckdb", "pandas"]
+
+
+def csv_stream(url: str) -> worker.stream.CsvStream:
+    """
+    Stream a CSV file from a URL or a local path, one block at a time.
+    """
+    import worker.stream
+    return worker.stream.CsvStream(url)
+
+
+def stream_table(stream: worker.stream.CsvStream) -> duckdb.table:
+    """
+    CSV stream => DuckDB, loaded batch by batch into a table that is dropped
+    once the result cache no longer holds it.
+    """
+    import worker.database
+    return worker.database.load_table(stream.to_reader(), "stream")
+
+
+def stream_df(stream: worker.stream.CsvStream) -> pandas.DataFrame:
+    """
+    CSV stream => Pandas DataFrame. The batches are read into one Arrow table,
+    whose columns are converted to pandas without keeping a second copy.
+    """
+    return stream.to_reader().read_all().to_pandas(split_blocks=True, self_destruct=True)
@@ -0,0 +1,83 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+
+Makes the worker and ui packages importable from the tests, and provides a
+local HTTP server and an empty HTTP cache for the tests of worker.fetch.
+"""
+
+import functools
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker import fetch # pylint: disable=wrong-import-position
+
+
+class Server():
+    """
+    Serves the files in a directory over HTTP, recording the path and status of
+    each request. A path with a gate sends its first bytes, and then waits for
+    the gate to open before sending the rest.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.requests = []
+        self.gates = {}
+        server = self
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            """ Records each request, and does not log to stderr """
+
+            def log_request(self, code="-", size="-"):
+                server.requests.append((self.path, int(getattr(code, "value", code))))
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                pass
+
+            def copyfile(self, source, outputfile):
+                if self.path in server.gates:
+                    size, gate = server.gates[self.path]
+                    outputfile.write(source.read(size))
+                    outputfile.flush()
+                    gate.wait(10)
+                super().copyfile(source, outputfile)
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(Handler, directory=str(directory)))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        """ Returns the URL of a file in the directory """
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{path}"
+
+    def stop(self):
+        """ Shuts the server down, so its URLs can no longer be reached """
+        if self.thread.is_alive():
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+
+
+@pytest.fixture
+def server(tmp_path):
+    """ A local HTTP server for the files in a temporary directory """
+    directory = tmp_path / "www"
+    directory.mkdir()
+    local = Server(directory)
+    yield local
+    local.stop()
+
+
+@pytest.fixture
+def http_cache(tmp_path, monkeypatch):
+    """ An empty HTTP cache in a temporary directory """
+    monkeypatch.setitem(fetch.settings, "directory", str(tmp_path / "cache"))
+    monkeypatch.setitem(fetch.state, "index", None)
+    monkeypatch.setattr(fetch, "downloads", {})
+    return tmp_path / "cache"
@@ -0,0 +1,27 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+"""
+
+from worker import cache as result_cache
+
+
+def test_set_preview_replaces_the_size_of_the_old_preview():
+    cache = result_cache.ResultCache()
+    cache.put("a", 1, None)
+    cache.set_preview("a", "x" * 10000)
+    size = cache.size
+    cache.set_preview("a", "y" * 10000)
+    cache.set_preview("a", "z" * 10000)
+    assert cache.size == size
+    assert cache.entries["a"][2] == size
+    assert cache.get("a") == (1, "z" * 10000)
+
+
+def test_set_preview_enforces_the_budget():
+    cache = result_cache.ResultCache(budget=20000)
+    cache.put("a", 1, None)
+    cache.put("b", 2, None)
+    cache.set_preview("b", "x" * 15000)
+    cache.set_preview("a", "y" * 15000)
+    assert cache.size <= cache.budget
+    assert list(cache.entries) == ["a"]
@@ -0,0 +1,33 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+"""
+
+from worker import compiler
+
+
+def test_module_level_statements_run_every_time():
+    code_cache = compiler.CodeCache()
+    namespace = {}
+    script = "N = 3\ndef q():\n    return N\nq()"
+    code_cache.run("q_1", script, namespace)
+    namespace["N"] = 99
+    code_cache.run("q_1", script, namespace)
+    assert namespace["q_1"] == 3
+
+
+def test_scripts_and_calls_are_bounded():
+    code_cache = compiler.CodeCache(max_scripts=4)
+    namespace = {}
+    for version in range(10):
+        code_cache.run("node_1", f"def f():\n    return {version}\nf()", namespace)
+        assert namespace["node_1"] == version
+    assert len(code_cache.scripts) == 4
+    assert len(code_cache.calls) == 4
+
+
+def test_delete_forgets_calls():
+    code_cache = compiler.CodeCache()
+    code_cache.run("node_1", "1 + 1", {})
+    code_cache.run("node_2", "1 + 1", {})
+    code_cache.delete("node_1")
+    assert [key for _hash, key in code_cache.calls] == ["node_2"]
@@ -0,0 +1,110 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+"""
+
+import pytest
+
+from worker import cache as result_cache
+from worker import database
+from worker import rows
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    """ Gives the database module a fresh DuckDB connection and empty bookkeeping """
+    duckdb = pytest.importorskip("duckdb")
+    connection = duckdb.connect()
+    monkeypatch.setitem(database.state, "connection", connection)
+    monkeypatch.setitem(database.state, "node", None)
+    monkeypatch.setitem(database.state, "cache_key", None)
+    for name in ("views", "references", "owned"):
+        monkeypatch.setattr(database, name, type(getattr(database, name))())
+    monkeypatch.setattr(database, "released", set())
+    yield connection
+    connection.close()
+
+
+def get_table_names(connection):
+    return {row[0] for row in connection.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+
+
+def test_relation_pages_cover_every_row_once(connection): # pylint: disable=redefined-outer-name
+    pytest.importorskip("numpy")
+    relation = connection.sql("SELECT x, x % 7 AS y FROM range(2500) t(x) WHERE x % 2 = 0")
+    snapshot = database.snapshot(relation, "node-1", "a" * 32)
+    seen = []
+    total = None
+    for start in range(0, 1250, 400):
+        page = rows.get_rows(snapshot, start, 400, None, total)
+        total = page["total"]
+        assert page["columns"] == ["x", "y"]
+        seen.extend(int(value) for value in memoryview(page["data"][0]["data"]).cast("q"))
+    assert total == 1250
+    assert sorted(seen) == list(range(0, 2500, 2))
+    again = rows.get_rows(database.snapshot(relation, "node-1", "a" * 32), 400, 400, ["y"])
+    assert again["columns"] == ["y"]
+    assert again["data"][0]["data"] == rows.get_rows(snapshot, 400, 400, ["y"])["data"][0]["data"]
+
+
+def test_snapshots_are_dropped_with_their_value(connection): # pylint: disable=redefined-outer-name
+    relation = connection.sql("SELECT * FROM range(10)")
+    database.snapshot(relation, "node-1", "a" * 32)
+    database.snapshot(relation, "node-2", "b" * 32)
+    assert len(get_table_names(connection)) == 2
+    database.collect({"b" * 32})
+    assert get_table_names(connection) == {"node-2__rows_" + "b" * 16}
+    database.delete("node-2")
+    assert not get_table_names(connection)
+
+
+def run_sql_table(cache, upstream, sql):
+    """ Runs the sql_table node for an upstream value the way the runner does, using the result cache """
+    cache_key = cache.get_key(f"sql_table({sql!r})", [upstream])
+    entry = cache.get(cache_key)
+    if entry is None:
+        database.state["node"] = "sql-1"
+        database.state["cache_key"] = cache_key
+        cache.put(cache_key, database.bind(database.state["connection"].sql(upstream), sql), None)
+        entry = cache.get(cache_key)
+    database.collect(set(cache.entries))
+    return entry[0].fetchall()
+
+
+def test_reverted_run_reads_its_own_input(connection): # pylint: disable=redefined-outer-name
+    cache = result_cache.ResultCache()
+    sql = "SELECT x FROM data ORDER BY x"
+    original = run_sql_table(cache, "SELECT * FROM range(3) t(x)", sql)
+    edited = run_sql_table(cache, "SELECT * FROM range(10, 12) t(x)", sql)
+    reverted = run_sql_table(cache, "SELECT * FROM range(3) t(x)", sql)
+    assert original == [(0,), (1,), (2,)]
+    assert edited == [(10,), (11,)]
+    assert reverted == original
+    assert len(get_table_names(connection)) == 2
+    cache.discard(next(iter(cache.entries)))
+    database.collect(set(cache.entries))
+    assert len(get_table_names(connection)) == 1
+
+
+def test_bind_merges_with_the_common_table_expressions_of_the_sql(connection): # pylint: disable=redefined-outer-name
+    relation = connection.sql("SELECT * FROM range(5) t(x)")
+    merged = database.bind(relation, "WITH small AS (SELECT x FROM data WHERE x < 2) SELECT * FROM small ORDER BY x")
+    assert merged.fetchall() == [(0,), (1,)]
+    recursive = database.bind(relation, """
+        with recursive steps(n) AS (SELECT max(x) FROM data UNION ALL SELECT n + 1 FROM steps WHERE n < 6)
+        SELECT n FROM steps ORDER BY n
+    """)
+    assert recursive.fetchall() == [(4,), (5,), (6,)]
+
+
+def test_stream_tables_are_named_after_the_cache_key(connection): # pylint: disable=redefined-outer-name
+    pyarrow = pytest.importorskip("pyarrow")
+    database.state["node"] = "stream-1"
+    for cache_key, rows in (("a" * 32, 3), ("b" * 32, 5)):
+        database.state["cache_key"] = cache_key
+        batch = pyarrow.record_batch({"x": list(range(rows))})
+        table = database.load_table(pyarrow.RecordBatchReader.from_batches(batch.schema, [batch]), "stream")
+        assert table.aggregate("count(*)").fetchone()[0] == rows
+    assert get_table_names(connection) == {"stream-1__stream_" + "a" * 16, "stream-1__stream_" + "b" * 16}
+    database.collect({"a" * 32})
+    assert get_table_names(connection) == {"stream-1__stream_" + "a" * 16}
+    assert connection.table('"stream-1__stream_' + "a" * 16 + '"').aggregate("count(*)").fetchone()[0] == 3
@@ -0,0 +1,88 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+"""
+
+from ui.dispatch import Dispatcher
+
+
+def request(key, inputs=()):
+    return [key, f"{key}()", list(inputs), False, []]
+
+
+def create(workers=("w0", "w1")):
+    sent = []
+    missing = []
+    dispatcher = Dispatcher(
+        workers,
+        lambda worker, topic, data: sent.append((worker, topic, data)),
+        lambda key, dropped: missing.append((key, dropped)),
+    )
+    for worker in workers:
+        dispatcher.worker_ready(worker)
+    return dispatcher, sent, missing
+
+
+def batches(sent):
+    return [(worker, [entry[0] for entry in data]) for worker, topic, data in sent if topic == "run_batch"]
+
+
+def test_choose_keeps_a_chain_on_one_worker():
+    dispatcher, sent, _missing = create()
+    dispatcher.submit([request("a"), request("b", ["a"]), request("c", ["b"])])
+    assert batches(sent) == [("w0", ["a", "b", "c"])]
+
+
+def test_choose_spreads_independent_nodes():
+    dispatcher, sent, _missing = create()
+    dispatcher.submit([request("a"), request("b")])
+    assert sorted(worker for worker, _keys in batches(sent)) == ["w0", "w1"]
+
+
+def test_transfer_moves_a_value_between_workers():
+    dispatcher, sent, _missing = create()
+    dispatcher.holders["a"] = {"w0"}
+    dispatcher.assigned["b"] = "w1"
+    dispatcher.queue.append(request("b", ["a"]))
+    dispatcher.flush()
+    dispatcher.flush()
+    assert sent == [("w0", "send_value", ["a", "w1"])]
+    sent.clear()
+    dispatcher.received("a", "w1")
+    assert batches(sent) == [("w1", ["b"])]
+
+
+def test_lost_drops_the_requests_that_need_the_value():
+    dispatcher, _sent, _missing = create()
+    dispatcher.holders["a"] = {"w0"}
+    dispatcher.assigned.update(b="w1", c="w1")
+    dispatcher.queue += [request("b", ["a"]), request("c", ["b"])]
+    dispatcher.flush()
+    assert dispatcher.lost("a", "w1") == {"b", "c"}
+    assert not dispatcher.queue
+    assert "a" not in dispatcher.holders
+    assert not dispatcher.transfers
+
+
+def test_evicted_reports_values_no_worker_holds():
+    dispatcher, _sent, _missing = create()
+    dispatcher.holders.update(a={"w0", "w1"}, b={"w0"})
+    assert dispatcher.evicted("w0", ["a", "b"]) == ["b"]
+    assert dispatcher.holders == {"a": {"w1"}}
+
+
+def test_request_for_an_evicted_value_is_not_stuck():
+    dispatcher, sent, missing = create()
+    dispatcher.submit([request("b", ["a"])])
+    assert not batches(sent)
+    assert missing == [("a", {"b"})]
+    assert not dispatcher.queue
+    assert not dispatcher.assigned
+
+
+def test_request_waits_for_an_input_that_is_still_running():
+    dispatcher, sent, missing = create()
+    dispatcher.submit([request("a")])
+    dispatcher.submit([request("b", ["a"])])
+    assert not missing
+    dispatcher.done("a")
+    assert [keys for _worker, keys in batches(sent)] == [["a"], ["b"]]
@@ -0,0 +1,61 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+"""
+
+import asyncio
+
+import pytest
+
+from worker import fetch
+
+
+def get_statuses(server):
+    return [status for _path, status in server.requests]
+
+
+def test_fresh_entry_is_read_without_a_request(server, http_cache): # pylint: disable=unused-argument
+    (server.directory / "a.txt").write_bytes(b"a" * 100)
+    assert fetch.fetch(server.url("a.txt")) == b"a" * 100
+    assert fetch.fetch(server.url("a.txt")) == b"a" * 100
+    assert get_statuses(server) == [200]
+
+
+def test_stale_entry_is_revalidated(server, http_cache, monkeypatch): # pylint: disable=unused-argument
+    (server.directory / "a.txt").write_bytes(b"a" * 100)
+    monkeypatch.setitem(fetch.settings, "ttl", 0)
+    assert fetch.fetch(server.url("a.txt")) == b"a" * 100
+    assert fetch.fetch(server.url("a.txt")) == b"a" * 100
+    assert get_statuses(server) == [200, 304]
+
+
+def test_least_recently_used_entry_is_evicted(server, http_cache, monkeypatch): # pylint: disable=unused-argument
+    monkeypatch.setitem(fetch.settings, "max_bytes", 2500)
+    for name in "abc":
+        (server.directory / f"{name}.txt").write_bytes(name.encode() * 1000)
+    fetch.fetch(server.url("a.txt"))
+    fetch.fetch(server.url("b.txt"))
+    fetch.fetch(server.url("a.txt"))
+    fetch.fetch(server.url("c.txt"))
+    assert sorted(fetch.get_index()) == [server.url("a.txt"), server.url("c.txt")]
+    assert sorted(path.name for path in http_cache.iterdir() if path.name != "index.json") == sorted(
+        entry["file"] for entry in fetch.get_index().values()
+    )
+
+
+def test_stale_entry_is_used_offline(server, http_cache, monkeypatch): # pylint: disable=unused-argument
+    (server.directory / "a.txt").write_bytes(b"a" * 100)
+    url = server.url("a.txt")
+    assert fetch.fetch(url) == b"a" * 100
+    server.stop()
+    monkeypatch.setitem(fetch.settings, "ttl", 0)
+    assert fetch.fetch(url) == b"a" * 100
+    with pytest.raises(OSError):
+        fetch.fetch(server.url("b.txt"))
+
+
+def test_fetch_all_requests_each_url_once(server, http_cache): # pylint: disable=unused-argument
+    for name in "abc":
+        (server.directory / f"{name}.txt").write_bytes(name.encode() * 10)
+    urls = [server.url("a.txt"), server.url("b.txt"), server.url("a.txt"), server.url("c.txt")]
+    assert asyncio.run(fetch.fetch_all(urls)) == [b"a" * 10, b"b" * 10, b"a" * 10, b"c" * 10]
+    assert sorted(server.requests) == [("/a.txt", 200), ("/b.txt", 200), ("/c.txt", 200)]
@@ -0,0 +1,86 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+"""
+
+import asyncio
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+from worker import fmp
+
+
+class FakeFmp(http.server.BaseHTTPRequestHandler):
+    """ Answers quote requests with one quote per known symbol, recording the symbols of each request """
+
+    requests = []
+
+    def do_GET(self): # pylint: disable=invalid-name
+        path = urllib.parse.urlparse(self.path).path
+        symbols = path.rsplit("/", 1)[-1].split(",")
+        FakeFmp.requests.append((time.monotonic(), symbols))
+        body = json.dumps([{"symbol": symbol, "price": 1.0} for symbol in symbols if symbol != "UNKNOWN"]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture
+def fake_fmp(monkeypatch):
+    """ Points the FMP clients to a local fake FMP server """
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeFmp)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    FakeFmp.requests = []
+    monkeypatch.setenv("FMP_BASE_URL", f"http://127.0.0.1:{httpd.server_address[1]}/api/v3")
+    monkeypatch.setattr(fmp, "clients", {})
+    yield FakeFmp.requests
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_quotes_are_batched_and_cached(fake_fmp, monkeypatch): # pylint: disable=redefined-outer-name
+    symbols = [f"S{index}" for index in range(120)]
+    client = fmp.get_client("key")
+    quotes = asyncio.run(client.quotes(symbols + ["unknown"]))
+    assert [quote["symbol"] for quote in quotes] == symbols
+    assert sorted(len(batch) for _time, batch in fake_fmp) == [21, 50, 50]
+
+    assert len(asyncio.run(client.quotes(symbols[:10]))) == 10
+    assert len(fake_fmp) == 3
+
+    later = time.time() + fmp.settings["quote_ttl"] + 1
+    monkeypatch.setattr(fmp.time, "time", lambda: later)
+    asyncio.run(client.quotes(symbols[:60]))
+    asyncio.run(client.quotes(symbols[:10]))
+    assert sorted(len(batch) for _time, batch in fake_fmp[3:]) == [10, 50]
+
+
+def test_token_bucket_limits_the_rate(fake_fmp, monkeypatch): # pylint: disable=redefined-outer-name
+    monkeypatch.setitem(fmp.settings, "rate", 20)
+    monkeypatch.setitem(fmp.settings, "burst", 2)
+    monkeypatch.setitem(fmp.settings, "batch", 1)
+    client = fmp.get_client("key")
+    start = time.monotonic()
+    asyncio.run(client.quotes([f"S{index}" for index in range(6)]))
+    assert len(fake_fmp) == 6
+    assert time.monotonic() - start >= 4 / 20 - 0.01
+    times = sorted(request_time - start for request_time, _batch in fake_fmp)
+    assert times[-1] >= 4 / 20 - 0.01
+
+
+def test_token_bucket_reserves_tokens_in_order():
+    bucket = fmp.TokenBucket(10, 2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0, 0]
+    assert waits[2] == pytest.approx(0.1, abs=0.01)
+    assert waits[3] == pytest.approx(0.2, abs=0.01)
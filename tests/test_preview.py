@@ -0,0 +1,73 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+"""
+
+import builtins
+import sys
+import time
+
+import pytest
+
+from worker import preview
+
+
+@pytest.fixture
+def without_matplotlib(monkeypatch):
+    """ Makes matplotlib and the flows package fail to import, as in a worker that did not load them """
+    real_import = builtins.__import__
+
+    def fake_import(name, *args, **kwargs):
+        if name.split(".")[0] in ("matplotlib", "flows"):
+            raise ModuleNotFoundError(f"No module named '{name}'")
+        return real_import(name, *args, **kwargs)
+
+    for name in list(sys.modules):
+        if name.split(".")[0] == "matplotlib":
+            monkeypatch.delitem(sys.modules, name)
+    monkeypatch.setattr(builtins, "__import__", fake_import)
+
+
+def test_relation_preview_without_matplotlib(without_matplotlib): # pylint: disable=redefined-outer-name,unused-argument
+    duckdb = pytest.importorskip("duckdb")
+    relation = duckdb.sql("SELECT range AS x FROM range(1000000)")
+    preview.timings.clear()
+    html = preview.create_preview(relation)
+    assert "DuckDB relation: more than" in html
+    assert "<table" in html
+    assert preview.timings["duckdb.DuckDBPyRelation"]["failures"] == 0
+
+
+def test_stream_preview_reads_the_first_batch(tmp_path):
+    pytest.importorskip("pyarrow")
+    from worker import stream # pylint: disable=import-outside-toplevel
+    path = tmp_path / "data.csv"
+    path.write_text("a,b\n" + "".join(f"{index},{index * 2}\n" for index in range(100)))
+    preview.timings.clear()
+    html = preview.create_preview(stream.CsvStream(str(path)))
+    assert "CSV stream: first 100 rows" in html
+    assert preview.timings["worker.CsvStream"]["failures"] == 0
+
+
+class Block():
+    """ A value with a known memory size, whose preview is slow when it is large """
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def __len__(self):
+        return self.nbytes
+
+
+def render_block(block, _view):
+    if block.nbytes > 1000000:
+        time.sleep(preview.settings["max_ms"] / 1000 + 0.05)
+    return f"<b>block of {block.nbytes}</b>"
+
+
+def test_slow_large_value_does_not_degrade_small_values(monkeypatch):
+    monkeypatch.setitem(preview.settings, "max_ms", 20)
+    preview.register(f"{__name__}.Block", render_block)
+    large = Block(100000000)
+    assert preview.create_preview(large) == "<b>block of 100000000</b>"
+    assert preview.create_preview(Block(100)) == "<b>block of 100</b>"
+    assert "preview-summary" in preview.create_preview(large)
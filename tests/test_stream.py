@@ -0,0 +1,51 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+"""
+
+import os
+import threading
+
+import pytest
+
+from worker import fetch
+from worker import stream as worker_stream
+
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("x,name\n")
+        for index in range(rows):
+            file.write(f"{index},row {index}\n")
+
+
+def test_local_file_is_read_batch_by_batch(tmp_path):
+    pytest.importorskip("pyarrow")
+    write_csv(tmp_path / "local.csv", 50000)
+    stream = worker_stream.CsvStream(str(tmp_path / "local.csv"), block_size=64 * 1024)
+    assert stream.schema.names == ["x", "name"]
+    assert 0 < stream.first.num_rows < 50000
+    batches = list(stream.to_reader())
+    assert len(batches) > 1
+    assert sum(batch.num_rows for batch in batches) == 50000
+
+
+def test_url_is_streamed_before_it_is_downloaded(server, http_cache): # pylint: disable=unused-argument
+    pytest.importorskip("pyarrow")
+    write_csv(server.directory / "slow.csv", 500000)
+    gate = threading.Event()
+    # The CSV reader reads a few blocks ahead, so the server holds back the end of a larger file.
+    server.gates["/slow.csv"] = (6 * 1024 * 1024, gate)
+    url = server.url("slow.csv")
+    try:
+        stream = worker_stream.CsvStream(url, block_size=64 * 1024)
+    finally:
+        gate.set()
+    assert 0 < stream.first.num_rows < 500000
+    assert url not in fetch.get_index()
+    assert not [name for name in os.listdir(fetch.settings["directory"]) if name.endswith(".part")]
+
+    assert sum(batch.num_rows for batch in stream.to_reader()) == 500000
+    assert fetch.get_index()[url]["size"] == os.path.getsize(server.directory / "slow.csv")
+    requests = len(server.requests)
+    assert sum(batch.num_rows for batch in stream.to_reader()) == 500000
+    assert len(server.requests) == requests
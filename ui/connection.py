@@ -65,7 +65,7 @@ class ConnectionView():
         self.add_to_nodes()
         self.model.name = self.end.attr("name")
         ConnectionView.current = None
-        node.NodeView.nodes[self.start.attr("key")].evaluate()
+        node.NodeView.flow.scheduler.run([self.start.attr("key")])
 
     def remove_old_connection(self):
         """ Remove the old connections from the nodes. """
@@ -0,0 +1,196 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+
+Assigns the nodes of a flow to a pool of runner workers.
+"""
+
+
+class Dispatcher():
+    """
+    Dispatches run requests to a pool of runner workers.
+
+    Nodes are sent to the worker that already holds most of their inputs,
+    so a chain stays on one worker, and otherwise to the least busy worker.
+    Values only move between workers when a dependency crosses them.
+
+    The dispatcher does not depend on the pub/sub transport. It calls
+    send(worker, topic, data) to talk to a worker, and expects done, failed,
+    received, lost and evicted to be called when the workers report back.
+    When a queued request needs a value that no worker holds or will produce,
+    the request is dropped and missing(key, dropped) is called, so the node
+    can be run again.
+    """
+    def __init__(self, workers, send, missing=None):
+        self.workers = list(workers)
+        self.send = send
+        self.missing = missing
+        self.ready = set()
+        self.holders = {}
+        self.assigned = {}
+        self.previous = {}
+        self.running = set()
+        self.transfers = set()
+        self.queue = []
+
+    def worker_ready(self, worker):
+        """ A worker finished booting and can accept requests. """
+        self.ready.add(worker)
+        self.flush()
+
+    def submit(self, plan):
+        """
+        Assigns each [key, script, inputs, force] request in the topologically
+        ordered plan to a worker, and sends the requests that can run now.
+        """
+        queued = set(entry[0] for entry in plan)
+        self.queue = [entry for entry in self.queue if entry[0] not in queued]
+        for entry in plan:
+            key = entry[0]
+            self.holders.pop(key, None)
+            self.assigned[key] = self.choose(entry)
+            self.queue.append(entry)
+        self.flush()
+
+    def choose(self, entry):
+        """
+        Chooses a worker for a request, preferring the worker that holds its inputs,
+        then the worker that ran the node before, then the least busy worker.
+        """
+        key, _script, inputs = entry[:3]
+        def score(worker):
+            local = len([
+                input_key
+                for input_key in inputs
+                if worker in self.holders.get(input_key, ()) or self.assigned.get(input_key) == worker
+            ])
+            load = len([k for k, w in self.assigned.items() if w == worker and k != key])
+            return (local, self.previous.get(key) == worker, -load)
+        return max(self.workers, key=score)
+
+    def is_available(self, input_key, worker, batch):
+        """ Returns whether the value of an input can be read on the given worker. """
+        return (
+            worker in self.holders.get(input_key, ())
+            or input_key in batch
+            or input_key in self.running and self.assigned.get(input_key) == worker
+        )
+
+    def flush(self):
+        """
+        Sends the queued requests whose inputs are available on their worker,
+        grouped into one batch per worker, and requests the missing values.
+        """
+        batches = {}
+        queue = []
+        unavailable = set()
+        for entry in self.queue:
+            key, _script, inputs = entry[:3]
+            worker = self.assigned[key]
+            batch = batches.setdefault(worker, {})
+            missing = [
+                input_key
+                for input_key in inputs
+                if not self.is_available(input_key, worker, batch)
+            ]
+            for input_key in missing:
+                if not self.transfer(input_key, worker) and input_key not in self.assigned:
+                    unavailable.add(input_key)
+            if missing or worker not in self.ready:
+                queue.append(entry)
+            else:
+                batch[key] = entry
+        self.queue = queue
+        for worker, batch in batches.items():
+            if batch:
+                self.running.update(batch)
+                self.send(worker, "run_batch", list(batch.values()))
+        for key in sorted(unavailable):
+            dropped = self.lost(key, None)
+            if self.missing:
+                self.missing(key, dropped)
+
+    def transfer(self, key, worker):
+        """
+        Asks a worker that holds the value of a node to send it to another worker.
+        Returns whether the value is on its way, False when no worker holds it.
+        """
+        if (key, worker) in self.transfers:
+            return True
+        holders = self.holders.get(key)
+        if not holders:
+            return False
+        self.transfers.add((key, worker))
+        self.send(sorted(holders)[0], "send_value", [key, worker])
+        return True
+
+    def done(self, key):
+        """ A worker produced the value for a node. """
+        worker = self.assigned.pop(key, None)
+        self.running.discard(key)
+        if worker:
+            self.previous[key] = worker
+            self.holders[key] = set([worker])
+        self.flush()
+
+    def failed(self, key):
+        """
+        A node failed or was skipped. Returns the keys of the queued requests
+        that depended on it and were dropped.
+        """
+        self.assigned.pop(key, None)
+        self.running.discard(key)
+        dropped = self.drop_dependents(key)
+        self.flush()
+        return dropped
+
+    def drop_dependents(self, key):
+        """
+        Removes the queued requests that depend on the given node, directly or
+        indirectly, and returns their keys.
+        """
+        dropped = set([key])
+        queue = []
+        for entry in self.queue:
+            if dropped.intersection(entry[2]):
+                dropped.add(entry[0])
+                self.assigned.pop(entry[0], None)
+            else:
+                queue.append(entry)
+        self.queue = queue
+        dropped.discard(key)
+        return dropped
+
+    def received(self, key, worker):
+        """ A worker received the value of a node from another worker. """
+        self.transfers.discard((key, worker))
+        self.holders.setdefault(key, set()).add(worker)
+        self.flush()
+
+    def lost(self, key, worker):
+        """
+        A worker could not receive the value of a node, because no worker could
+        send it, or no worker holds it anymore. Forgets the holders of the node and drops the queued requests that
+        depend on it. Returns the keys of the dropped requests.
+        """
+        self.transfers.discard((key, worker))
+        self.holders.pop(key, None)
+        return self.drop_dependents(key)
+
+    def evicted(self, worker, keys):
+        """
+        A worker released the values of some nodes. Returns the keys
+        that are no longer held by any worker.
+        """
+        lost = []
+        for key in keys:
+            holders = self.holders.get(key, set())
+            holders.discard(worker)
+            if not holders:
+                self.holders.pop(key, None)
+                lost.append(key)
+        return lost
+
+    def broadcast(self, topic, data):
+        """ Sends a message to all the workers. """
+        for worker in self.workers:
+            self.send(worker, topic, data)
@@ -13,7 +13,21 @@ import ltk
 from polyscript import XWorker # type: ignore   pylint: disable=import-error
 
 from ui import connection
+from ui import dispatch
 from ui import node
+from ui import viewer
+
+
+def get_worker_names():
+    """ The names of the runner workers, configured with the flow-workers setting. """
+    count = int(ltk.window.localStorage.getItem("flow-workers") or 1)
+    return [f"pyodide-runner-{index}" for index in range(max(1, count))]
+
+
+WORKERS = get_worker_names()
+CATALOG_VERSION = 1
+runner_workers = {}
+options_state = { "needed": False }
 
 
 class Flow(ltk.Model):  # pylint: disable=too-many-instance-attributes
@@ -51,10 +65,181 @@ class Flow(ltk.Model):  # pylint: disable=too-many-instance-attributes
             if c.end_key != new_connection.end_key and c.name != new_connection.name
         ] + [new_connection]
 
+    def get_inputs(self, key):
+        """
+        Returns the keys of the nodes that provide inputs to the given node.
+        """
+        return [c.start_key for c in self.connections if c.end_key == key]
+
+    def get_outputs(self, key):
+        """
+        Returns the keys of the nodes that consume the output of the given node.
+        """
+        return [c.end_key for c in self.connections if c.start_key == key]
+
+    def get_downstream(self, keys):
+        """
+        Returns the given keys and all the nodes that depend on them.
+        """
+        found = set()
+        todo = list(keys)
+        while todo:
+            key = todo.pop()
+            if key in found:
+                continue
+            found.add(key)
+            todo.extend(self.get_outputs(key))
+        return found
+
+    def sort(self, keys):
+        """
+        Returns the given keys in topological order, considering only
+        the connections between them.
+        """
+        keys = set(keys)
+        waiting = {
+            key: len([start for start in self.get_inputs(key) if start in keys])
+            for key in keys
+        }
+        ready = [key for key in self.nodes if waiting.get(key) == 0]
+        order = []
+        while ready:
+            key = ready.pop(0)
+            order.append(key)
+            for end in self.get_outputs(key):
+                if end in waiting:
+                    waiting[end] -= 1
+                    if waiting[end] == 0:
+                        ready.append(end)
+        return order
+
     def save(self):
         """ Save this flow and all the nodes. """
 
 
+class Scheduler():
+    """
+    Runs the nodes affected by a change in topological order.
+
+    Each affected node is sent to the worker exactly once, after all of
+    its upstream nodes in the same change have produced their result.
+    """
+    def __init__(self, model: Flow, dispatcher: dispatch.Dispatcher):
+        self.model = model
+        self.dispatcher = dispatcher
+        self.pending = {}
+        self.running = set()
+        self.forced = set()
+        self.evicted = set()
+        self.skipped = 0
+
+    def get_evicted_upstream(self, keys):
+        """
+        Returns the upstream nodes whose values were released by the worker
+        and are needed to run the given nodes.
+        """
+        found = set()
+        todo = list(keys)
+        while todo:
+            for start in self.model.get_inputs(todo.pop()):
+                if start in self.evicted and start not in found and start not in keys:
+                    found.add(start)
+                    todo.append(start)
+        return found
+
+    def run(self, keys, force=False):
+        """
+        Schedules the given nodes and all the nodes downstream from them.
+        Upstream nodes that were released by the worker are scheduled as well.
+        """
+        dirty = self.model.get_downstream(keys)
+        dirty.update(self.get_evicted_upstream(dirty))
+        if force:
+            self.forced.update(keys)
+        for key in self.model.sort(dirty):
+            inputs = [start for start in self.model.get_inputs(key) if start in dirty]
+            self.skipped += max(0, len(inputs) - 1)
+            if key in self.pending:
+                self.skipped += 1
+                self.pending[key].update(inputs)
+            else:
+                self.pending[key] = set(inputs)
+        self.dispatch()
+
+    def dispatch(self):
+        """
+        Sends the nodes that can run now to the worker as one batch, in topological order.
+        A node can run when each of its inputs is ready or computed earlier in the batch.
+        Nodes that are still running are sent again, the worker cancels their stale run.
+        """
+        plan = []
+        planned = set()
+        for key, waiting in list(self.pending.items()):
+            if key not in self.pending or not waiting <= planned:
+                continue
+            del self.pending[key]
+            force = key in self.forced
+            self.forced.discard(key)
+            view = node.NodeView.nodes[key]
+            request = view.model.get_request(force)
+            if request:
+                plan.append(request + [view.get_view_info()])
+                planned.add(key)
+            else:
+                self.drop(key)
+        if plan:
+            for key in planned:
+                node.NodeView.nodes[key].start_running()
+            self.running.update(planned)
+            self.dispatcher.submit(plan)
+
+    def done(self, key):
+        """
+        Called when the worker produced a result for the given node.
+        """
+        self.running.discard(key)
+        self.evicted.discard(key)
+        self.dispatcher.done(key)
+        for waiting in self.pending.values():
+            waiting.discard(key)
+        self.dispatch()
+        if not self.pending and not self.running:
+            print(f"Scheduler: skipped {self.skipped} redundant runs so far")
+
+    def failed(self, key):
+        """
+        Called when the given node failed or was skipped, so its downstream nodes cannot run.
+        """
+        self.running.discard(key)
+        for dropped in self.dispatcher.failed(key):
+            self.running.discard(dropped)
+            node.NodeView.nodes[dropped].stop_running()
+        self.drop(key)
+        self.dispatch()
+
+    def drop(self, key):
+        """
+        Removes the nodes downstream from the given node from the schedule.
+        The worker skips the downstream nodes that were already sent in a batch.
+        """
+        for end in self.model.get_downstream([key]):
+            if end != key:
+                self.pending.pop(end, None)
+
+
+
+def publish_worker(worker, topic, data):
+    """ Send a message to one of the runner workers. """
+    ltk.publish("Flow", worker, topic, data)
+
+
+def publish_binary(worker, topic, *data):
+    """
+    Send a message with binary data, such as a Uint8Array, to one of the runner
+    workers. The data is passed as a JavaScript array, instead of as JSON.
+    """
+    runner_workers[worker].sync.handler("Flow", topic, ltk.window.Array.of(*data))
+
 
 class FlowView():
     """
@@ -65,6 +250,12 @@ class FlowView():
     def __init__(self, model: Flow):
         self.model = model
         self.secrets = {}
+        self.dispatcher = dispatch.Dispatcher(
+            WORKERS,
+            publish_worker,
+            lambda key, dropped: rerun_lost(key, dropped), # pylint: disable=unnecessary-lambda
+        )
+        self.scheduler = Scheduler(model, self.dispatcher)
         self.load_nodes()
         self.load_connections()
 
@@ -80,6 +271,8 @@ class FlowView():
         node_view.remove()
         if node_view.model.key in self.model.nodes:
             del self.model.nodes[node_view.model.key]
+        self.scheduler.evicted.discard(node_view.model.key)
+        self.dispatcher.broadcast("delete", node_view.model.key)
         connection.ConnectionView.draw_all()
 
     def load_connections(self):
@@ -91,33 +284,48 @@ class FlowView():
             for connection in self.model.connections
         ]))
 
-    def handle_worker_result(self, result):
+    def request_previews(self):
+        """
+        Ask the workers for the previews of nodes that became visible.
+        """
+        for key, view in node.NodeView.nodes.items():
+            if view.preview_pending and view.is_visible():
+                view.preview_pending = False
+                publish_worker(
+                    self.dispatcher.previous.get(key, WORKERS[0]),
+                    "preview",
+                    [key, view.get_view_info()],
+                )
+
+    def expand_preview(self, key, path, offset):
         """
-        Handles the result from the worker, updating the UI.
+        Ask the worker that holds the value of a node for a part of its preview.
         """
-        key = result["key"]
-        model = self.model.nodes[key]
-        model.output = result["value"]
-        if result.get("error"):
-            ltk.find(f"#{key}").addClass("node-view-error")
-            result["preview"] = f"<pre>{result['error']}</pre>"
-        model.preview = result["preview"]
-        ltk.find(f"#{key}").find(".node-view-preview").empty().append(
-            ltk.create(model.preview)
-            if model.preview.startswith("<") else
-            ltk.Preformatted(model.preview)
+        publish_worker(
+            self.dispatcher.previous.get(key, WORKERS[0]),
+            "expand",
+            [key, path, offset],
         )
-        node.NodeView.nodes[key].stop_running()
-        for line in self.model.connections:
-            if line.start_key == key:
-                node.NodeView.nodes[line.end_key].evaluate()
+
+    def view_rows(self, key):
+        """
+        Open a table viewer that pages the rows of the value of a node from its worker.
+        """
+        viewer.TableViewer(
+            key,
+            self.dispatcher.previous.get(key, WORKERS[0]),
+            publish_worker,
+        ).open(self.model.nodes[key].name)
 
     def worker_ready(self, _info):
         """
         Evaluate nodes that need running in the worker.
         """
-        for root in [ node for node in self.model.nodes.values() if not node.inputs ]:
-            node.NodeView.nodes[root.key].evaluate()
+        self.scheduler.run([
+            root.key
+            for root in self.model.nodes.values()
+            if not root.inputs
+        ])
 
     def create_connection(self, start_key, end_key, name):
         """ Create a new connection """
@@ -140,6 +348,8 @@ class FlowView():
             **kwargs
         )
         self.check_secrets(secrets)
+        if packages:
+            self.dispatcher.broadcast("prefetch", packages)
         view = node.NodeView(model, self)
         view.appendTo(ltk.find(".flow"))
         return view
@@ -211,19 +421,112 @@ class FlowView():
 
 flow = FlowView(Flow())
 
-def worker_ready(data):
+def worker_ready(worker):
     """ Worker is ready """
-    print(data)
+    print("Worker ready:", worker)
+    publish_worker(worker, "settings", {
+        "budget": ltk.window.localStorage.getItem("flow-cache-budget"),
+        "keep": ltk.window.localStorage.getItem("flow-keep"),
+        "preview_bytes": ltk.window.localStorage.getItem("flow-preview-bytes"),
+        "preview_ms": ltk.window.localStorage.getItem("flow-preview-ms"),
+        "duckdb_memory": ltk.window.localStorage.getItem("flow-duckdb-memory"),
+        "duckdb_threads": ltk.window.localStorage.getItem("flow-duckdb-threads"),
+        "duckdb_spill": ltk.window.localStorage.getItem("flow-duckdb-spill"),
+        "http_ttl": ltk.window.localStorage.getItem("flow-http-ttl"),
+        "http_max_bytes": ltk.window.localStorage.getItem("flow-http-max-bytes"),
+    })
+    flow.dispatcher.worker_ready(worker)
+    if worker == WORKERS[0] and options_state["needed"]:
+        publish_worker(worker, "options", "")
+
+def handle_cache(stats):
+    """ Worker reported the result cache statistics """
+    print("Result cache:", ltk.to_py(stats))
 
 def handle_error(data):
     """ Worker errored """
     print("###### Error", data)
-    handle_result(data)
-
-def handle_result(data):
-    """ Worker ran a node """
+    node.NodeView.nodes[data[0]].stop_running()
+    show_result(data)
+    flow.scheduler.failed(data[0])
+
+def handle_evicted(data):
+    """ Worker released the values of nodes that are no longer needed """
+    worker, keys = ltk.to_py(data)
+    flow.scheduler.evicted.update(flow.dispatcher.evicted(worker, keys))
+
+def handle_value(data):
+    """ Worker sent the value of a node that another worker needs """
+    key, target, cache_key, payload = data
+    publish_binary(target, "receive_value", key, cache_key, payload)
+
+def handle_received(data):
+    """ Worker received the value of a node from another worker """
+    key, worker = data
+    flow.dispatcher.received(key, worker)
+
+def handle_lost(data):
+    """ Worker could not receive the value of a node, so the node runs again """
+    key, worker = data
+    rerun_lost(key, flow.dispatcher.lost(key, worker))
+
+def rerun_lost(key, dropped):
+    """ No worker holds the value of a node anymore, so it runs again, followed by the dropped nodes that need it """
+    for dropped_key in dropped:
+        flow.scheduler.running.discard(dropped_key)
+    flow.scheduler.evicted.add(key)
+    flow.scheduler.run([key])
+
+def handle_memory(sizes):
+    """ Worker reported the approximate bytes held per node """
+    for key, size in ltk.to_py(sizes).items():
+        if key in node.NodeView.nodes:
+            node.NodeView.nodes[key].attr("title", f"{size} bytes in the worker")
+
+def handle_skipped(key):
+    """ Worker skipped a node because one of its inputs failed """
+    node.NodeView.nodes[key].stop_running()
+    flow.scheduler.failed(key)
+
+def handle_done(key):
+    """ Worker ran a node, its preview follows later """
+    view = node.NodeView.nodes[key]
+    view.stop_running()
+    view.preview_pending = not view.is_visible()
+    flow.scheduler.done(key)
+
+def handle_preview(data):
+    """ Worker rendered the preview of a node """
+    node.NodeView.nodes[data[0]].preview_pending = False
+    show_result(data)
+
+def handle_expanded(data):
+    """ Worker rendered a part of the preview of a node """
+    key, path, offset, html = data
+    if key in node.NodeView.nodes:
+        node.NodeView.nodes[key].show_expanded(path, offset, html)
+
+def handle_rows(data):
+    """ Worker sent a page of rows for a table viewer """
+    table_viewer = viewer.TableViewer.viewers.get(data[0])
+    if table_viewer:
+        table_viewer.handle_rows(data[1])
+
+def show_result(data):
+    """ Show the result of a node """
     key = data[0]
     preview = data[1]
+    if isinstance(preview, (int, float)):
+        preview = str(preview)
+    elif not isinstance(preview, str) and preview.kind == "image":
+        preview = {
+            "kind": "image",
+            "mime": preview.mime,
+            "hash": preview.hash,
+            "data": preview.data,
+        }
+    elif not isinstance(preview, str):
+        preview = ltk.to_py(preview)
     flow_node = node.NodeView.nodes[key]
     flow_node.handle_worker_result(flow.model, {
         "key": key,
@@ -233,37 +536,45 @@ def handle_result(data):
 def handle_options(options):
     """ Worker found node options """
     ltk.find(".node-options").empty()
-    for name, options in ltk.to_py(options).items():
+    if not isinstance(options, dict):
+        options = ltk.to_py(options)
+    for name, options in options.items():
         category = ltk.VBox(ltk.Text(name)).addClass("node-option-category")
         ltk.find(".node-options").append(category)
         for option in options:
             flow.create_option(category, **option)
 
 def setup_worker():
-    """ Setup the worker """
+    """ Setup the pool of runner workers """
     ltk.subscribe("Main", "ready", worker_ready)
-    ltk.subscribe("Main", "result", handle_result)
+    ltk.subscribe("Main", "done", handle_done)
+    ltk.subscribe("Main", "preview", handle_preview)
+    ltk.subscribe("Main", "expanded", handle_expanded)
+    ltk.subscribe("Main", "rows", handle_rows)
     ltk.subscribe("Main", "error", handle_error)
+    ltk.subscribe("Main", "skipped", handle_skipped)
+    ltk.subscribe("Main", "evicted", handle_evicted)
+    ltk.subscribe("Main", "memory", handle_memory)
+    ltk.subscribe("Main", "cache", handle_cache)
+    ltk.subscribe("Main", "value", handle_value)
+    ltk.subscribe("Main", "received", handle_received)
+    ltk.subscribe("Main", "lost", handle_lost)
     config = {
         "interpreter": "pyodide/pyodide.js",
-        "packages": [ 
-            "pandas", "duckdb", "matplotlib", "plotly", "fmpsdk",
-        ],
+        "packages": [],
         "files": { 
+            "worker/packages.py": "worker/packages.py",
             "worker/preview.py": "worker/preview.py",
-        },
-    }
-    worker = XWorker("worker/runner.py", config=ltk.to_js(config), service_worker=True, type="pyodide")
-    ltk.register_worker("pyodide-runner", worker)
-
-
-def setup_options():
-    """ Setup the options """
-    config = {
-        "interpreter": "pyodide/pyodide.js",
-        "packages": [],
-        "files": {
-            "worker/options.py": "worker/options.py",
+            "worker/cache.py": "worker/cache.py",
+            "worker/state.py": "worker/state.py",
+            "worker/compiler.py": "worker/compiler.py",
+            "worker/transport.py": "worker/transport.py",
+            "worker/rows.py": "worker/rows.py",
+            "worker/database.py": "worker/database.py",
+            "worker/stream.py": "worker/stream.py",
+            "worker/fetch.py": "worker/fetch.py",
+            "worker/fmp.py": "worker/fmp.py",
+            "worker/catalog.py": "worker/catalog.py",
             "flows/__init__.py": "flows/__init__.py",
             "flows/basic/boolean.py": "flows/basic/boolean.py",
             "flows/basic/string.py": "flows/basic/string.py",
@@ -271,13 +582,72 @@ def setup_options():
             "flows/finance/fmp.py": "flows/finance/fmp.py",
             "flows/data/sql.py": "flows/data/sql.py",
             "flows/input/file.py": "flows/input/file.py",
+            "flows/input/stream.py": "flows/input/stream.py",
         },
     }
-    ltk.subscribe("Main", "options", handle_options)
-    options = XWorker("worker/options.py", config=ltk.to_js(config), service_worker=True, type="pyodide")
-    ltk.register_worker("pyodide-options", options)
+    for name in WORKERS:
+        config["worker_name"] = name
+        worker = XWorker("worker/runner.py", config=ltk.to_js(config), service_worker=True, type="pyodide")
+        ltk.register_worker(name, worker)
+        runner_workers[name] = worker
+
+
+def setup_options():
+    """ Ask the first runner worker to introspect the flows for node options """
+    options_state["needed"] = True
+    if WORKERS[0] in flow.dispatcher.ready:
+        publish_worker(WORKERS[0], "options", "")
+
+def get_last_modified(response):
+    """ The Last-Modified time of a response in milliseconds, or 0 when unknown """
+    header = response.headers.get("Last-Modified")
+    return ltk.window.Date.parse(header) if header else 0
+
+def check_catalog(catalog, modified):
+    """ Introspect the flows when any of their files is newer than the catalog """
+    checked = { "stale": False }
+
+    def check(response):
+        if not checked["stale"] and get_last_modified(response) > modified:
+            checked["stale"] = True
+            print("Catalog is older than", response.url, "- introspecting the flows")
+            setup_options()
+
+    if not modified:
+        return
+    for path in catalog["files"]:
+        ltk.window.fetch(path, ltk.to_js({ "method": "HEAD" })).then(ltk.proxy(check))
+
+def load_catalog():
+    """ Load the precomputed catalog of node options, falling back to introspection """
+    state = {}
+
+    def loaded(response):
+        if not response.ok:
+            raise ValueError(f"catalog.json: {response.status}")
+        state["modified"] = get_last_modified(response)
+        return response.json()
+
+    def handle_catalog(data):
+        catalog = ltk.to_py(data)
+        if catalog.get("version") != CATALOG_VERSION:
+            setup_options()
+            return
+        handle_options(catalog["options"])
+        check_catalog(catalog, state["modified"])
+
+    def failed(error):
+        print("Cannot load the catalog:", error)
+        setup_options()
+
+    ltk.window.fetch("catalog.json") \
+        .then(ltk.proxy(loaded)) \
+        .then(ltk.proxy(handle_catalog)) \
+        .catch(ltk.proxy(failed))
 
 def setup():
     """ Setup the flow """
-    setup_options()
+    ltk.find(ltk.window).on("scroll resize", ltk.proxy(lambda event: flow.request_previews()))
+    ltk.subscribe("Main", "options", handle_options)
+    load_catalog()
     setup_worker()
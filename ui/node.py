@@ -4,6 +4,7 @@ Copyright (c) 2024 laffra - All Rights Reserved.
 Represents a Node in the flow.
 """
 
+import json
 import time
 
 import ltk
@@ -19,7 +20,7 @@ class Node(ltk.Model):
     y: float = 2500
 
     def __init__(self, key="", script="", name="", secrets=None,
-                packages=None, imports=None, inputs=None, selected=False,
+                packages=None, imports=None, inputs=None, selected=False, pinned=False,
                 x=100, y=250, width="fit-content", height="fit-content",
                 output="", output_type="", preview="", flow=None, **_args):
         super().__init__()
@@ -39,6 +40,7 @@ class Node(ltk.Model):
         self.output_type = output_type
         self.output = output
         self.selected = selected
+        self.pinned = pinned
         self.connections = {}
 
     def changed(self, name, value):
@@ -65,16 +67,25 @@ class Node(ltk.Model):
         ]
         return "\n".join(imports + secrets + [script] + call)
 
-    def evaluate(self):
-        """ Evaluate the node. """
+    def get_input_keys(self):
+        """ Get the keys of the nodes that provide the inputs for this node. """
+        return [
+            connection.start_key
+            for connection in self.connections.values()
+        ]
+
+    def get_request(self, force=False):
+        """
+        Get the request to run this node in the worker, or None when the node cannot run.
+        When force is set, a cached result is not reused.
+        """
         if len(self.connections) < len(self.inputs):
-            return
+            return None
         try:
             script = self.get_script()
         except Exception: # pylint: disable=broad-exception-caught
-            return False
-        ltk.publish("Flow", "Worker", "run", [self.key, script])
-        return True
+            return None
+        return [self.key, script, self.get_input_keys(), force, self.packages or []]
 
     def save(self):
         """ Save the flow for this node. """
@@ -101,6 +112,12 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
             ltk.Button("❌", self.delete)
                 .addClass("node-view-control")
                 .addClass("node-view-delete-button"),
+            ltk.Button("📌", self.pin)
+                .addClass("node-view-control")
+                .addClass("node-view-pin-button"),
+            ltk.Button("🔍", self.view_rows)
+                .addClass("node-view-control")
+                .addClass("node-view-rows-button"),
             ltk.Text(model.name)
                 .on("click", ltk.proxy(lambda event: self.raise_to_top()))
                 .addClass("node-view-label"),
@@ -114,6 +131,7 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
             ).addClass("node-view-connectors"),
             ltk.Div(
                 ltk.Div("")
+                    .on("click", ltk.proxy(lambda event: self.expand(event)))
                     .addClass("node-view-preview"),
                 ltk.TextArea(str(model.script))
                     .on("change", ltk.proxy(lambda event: self.save_script()))
@@ -128,6 +146,9 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
         self.addClass("node-view")
         if model.selected:
             self.addClass("node-view-selected")
+        if model.pinned:
+            self.addClass("node-view-pinned")
+            flow.dispatcher.broadcast("pin", [model.key, True])
         self.css(ltk.to_js({
             "left": f"{model.x}px",
             "top": f"{model.y}px",
@@ -142,6 +163,10 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
         self.add_connectors(model.output_type)
         self.input_connections = {}
         self.output_connections = []
+        self.preview_pending = False
+        self.preview_hash = None
+        self.label_preview = False
+        self.image_url = None
 
         self.resizable(ltk.to_js({"handles": "se"}))
         self.draggable()
@@ -171,9 +196,12 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
         node.input_connections[name] = input_connection
         node.model.connections[name] = input_connection.model
 
-    def run(self, _event=None):
-        """ Run this node """
-        self.evaluate()
+    def run(self, event=None):
+        """
+        Run this node and the nodes downstream from it.
+        Clicking the run button ignores any cached result.
+        """
+        self.evaluate(force=event is not None)
 
     def edit(self, _event):
         """ Edit this node """
@@ -184,6 +212,40 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
         self.flow.delete_node(self)
         self.model.save()
 
+    def pin(self, _event):
+        """ Keep the output of this node in the worker """
+        self.model.pinned = not self.model.pinned
+        self.toggleClass("node-view-pinned", self.model.pinned)
+        self.flow.dispatcher.broadcast("pin", [self.model.key, self.model.pinned])
+        self.model.save()
+
+    def expand(self, event):
+        """ Ask the worker for the part of a preview hidden behind a "more…" placeholder """
+        more = ltk.find(event.target).closest(".preview-more")
+        if not more.length or more.hasClass("preview-expanding"):
+            return
+        more.addClass("preview-expanding")
+        self.flow.expand_preview(
+            self.model.key,
+            json.loads(more.attr("data-path")),
+            int(more.attr("data-offset")),
+        )
+
+    def show_expanded(self, path, offset, html):
+        """ Replace a "more…" placeholder with the part of the preview it stands for """
+        more = self.find(f".preview-more[data-path='{json.dumps(path)}'][data-offset='{offset}']")
+        if not more.length:
+            return
+        content = ltk.create(html)
+        if offset:
+            more.closest("tr").replaceWith(content.find("> tbody > tr"))
+        else:
+            more.replaceWith(content)
+
+    def view_rows(self, _event):
+        """ Show all the rows of the output of this node in a table viewer """
+        self.flow.view_rows(self.model.key)
+
     def raise_to_top(self):
         """ Raise the node to the top """
         self.appendTo(ltk.find(".flow"))
@@ -198,6 +260,7 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
         self.model.y = ltk.window.parseFloat(self.css("top"))
         self.model.save()
         connection.ConnectionView.draw_all()
+        self.flow.request_previews()
 
     def resize(self):
         """ The user resize the node """
@@ -205,6 +268,7 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
         self.model.height = self.height()
         self.model.save()
         connection.ConnectionView.draw_all()
+        self.flow.request_previews()
 
     def add_connectors(self, output_name):
         """ Add input and output connectors """
@@ -235,6 +299,26 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
             self.find(".node-view-outputs").width(),
         )
 
+    def is_visible(self):
+        """ Whether the preview of the node is on screen """
+        rect = self.element[0].getBoundingClientRect()
+        return all([
+            rect.bottom > 0,
+            rect.right > 0,
+            rect.top < ltk.window.innerHeight,
+            rect.left < ltk.window.innerWidth,
+            self.find(".node-view-content").css("display") != "none",
+        ])
+
+    def get_view_info(self):
+        """ The visibility and size of the preview of the node, sent along with run requests """
+        return {
+            "visible": self.is_visible(),
+            "width": max(200, self.width()),
+            "height": max(150, self.height() - 60),
+            "ratio": ltk.window.devicePixelRatio or 1,
+        }
+
     def start_running(self):
         """ Start the running node """
         self.removeClass("node-view-error")
@@ -247,32 +331,195 @@ class NodeView(ltk.Div): # pylint: disable=too-many-public-methods
         duration = time.time() - self.start_time
         info = f"{self.model.name} | {duration:.2f}s" if self.model.inputs else self.model.output
         self.find(".node-view-label").text(info)
-        connection.ConnectionView.draw_all()
+        if self.label_preview:
+            self.preview_hash = None # the label no longer shows the preview
+        schedule_draw()
 
-    def evaluate(self):
-        """ Evaluate the node. """
-        if self.model.evaluate():
-            self.start_running()
+    def evaluate(self, force=False):
+        """ Evaluate the node and the nodes downstream from it. """
+        self.flow.scheduler.run([self.model.key], force)
 
     def handle_worker_result(self, flow, result):
         """
-        Handles the result from the worker, updating the UI.
+        Handles the result from the worker, updating the UI in the next animation frame.
+        Previews that did not change are not written to the DOM at all.
         """
         key = result["key"]
         node = NodeView.nodes[key]
-        node.stop_running()
         model = node.model
         model.preview = preview = result["preview"]
         if result.get("error"):
             ltk.find(f"#{key}").addClass("node-view-error")
             preview = f"Error: <pre>{result['error']}</pre>"
-        if preview.startswith("<"):
-            node.find(".node-view-preview").empty().append(
-                ltk.create(preview)
-            )
+        preview_hash = get_preview_hash(preview)
+        if preview_hash == node.preview_hash:
+            return
+        node.preview_hash = preview_hash
+        node.label_preview = isinstance(preview, str) and not preview.startswith("<")
+        if isinstance(preview, dict):
+            schedule_write(key, lambda: node.show_structured_preview(preview))
+        elif preview.startswith("<"):
+            schedule_write(key, lambda: patch_html(node.find(".node-view-preview"), preview))
         else:
-            node.find(".node-view-label").text(preview)
-        if not result.get("error"):
-            for line in flow.connections:
-                if line.start_key == key:
-                    NodeView.nodes[line.end_key].evaluate()
+            schedule_write(key, lambda: node.find(".node-view-label").text(preview))
+
+    def show_structured_preview(self, preview):
+        """
+        Shows a preview that is rendered on the main thread, such as a Plotly figure
+        or a PNG image that was sent as bytes.
+        """
+        if preview["kind"] == "image":
+            blob = ltk.window.Blob.new([preview["data"]], ltk.to_js({ "type": preview["mime"] }))
+            if self.image_url:
+                ltk.window.URL.revokeObjectURL(self.image_url)
+            self.image_url = ltk.window.URL.createObjectURL(blob)
+            image = self.find(".node-view-image")
+            if not image.length:
+                image = ltk.Image(self.image_url).addClass("node-view-image").element
+                self.find(".node-view-preview").empty().append(image)
+            image.attr("src", self.image_url)
+        elif preview["kind"] == "plotly":
+            figure = ltk.window.JSON.parse(preview["figure"])
+            chart = self.find(".node-view-plotly")
+            if not chart.length:
+                chart = ltk.Div().addClass("node-view-plotly").element
+                self.find(".node-view-preview").empty().append(chart)
+            load_plotly(lambda: ltk.window.Plotly.react(
+                chart[0],
+                figure.data,
+                figure.layout,
+                ltk.to_js({ "responsive": True, "displaylogo": False }),
+            ))
+
+
+plotly = {
+    "state": "missing",
+    "pending": [],
+}
+
+
+def load_plotly(callback):
+    """
+    Calls the callback once plotly.js is loaded. The library is large, so it is
+    only loaded when the first Plotly preview is shown, not at startup.
+    """
+    if plotly["state"] == "loaded":
+        callback()
+        return
+    plotly["pending"].append(callback)
+    if plotly["state"] == "loading":
+        return
+    plotly["state"] = "loading"
+
+    def loaded(event):
+        plotly["state"] = "loaded"
+        pending, plotly["pending"] = plotly["pending"], []
+        for pending_callback in pending:
+            pending_callback()
+
+    def failed(event):
+        plotly["state"] = "missing"
+        plotly["pending"] = []
+        print("Cannot load plotly.js")
+
+    script = ltk.window.document.createElement("script")
+    script.onload = ltk.proxy(loaded)
+    script.onerror = ltk.proxy(failed)
+    script.src = "lib/plotly.min.js"
+    ltk.window.document.head.appendChild(script)
+
+
+frame = {
+    "requested": False,
+    "writes": {},
+    "draw": False,
+}
+
+
+def get_preview_hash(preview):
+    """ A hash of the content of a preview, to skip updates that do not change it """
+    if isinstance(preview, dict):
+        return preview.get("hash") or hash(preview.get("figure"))
+    return hash(preview)
+
+
+def schedule_write(key, write):
+    """
+    Write to the DOM in the next animation frame. A later write for the same
+    node replaces the earlier one, so only the last preview is shown.
+    """
+    frame["writes"][key] = write
+    request_frame()
+
+
+def schedule_draw():
+    """ Draw the connections once in the next animation frame """
+    frame["draw"] = True
+    request_frame()
+
+
+def request_frame():
+    """ Request an animation frame to flush the scheduled DOM writes """
+    if not frame["requested"]:
+        frame["requested"] = True
+        ltk.window.requestAnimationFrame(ltk.proxy(flush_frame))
+
+
+def flush_frame(_timestamp):
+    """ Perform all the DOM writes scheduled for this frame, then draw the connections once """
+    writes = frame["writes"]
+    frame["writes"] = {}
+    frame["requested"] = False
+    for write in writes.values():
+        write()
+    if writes or frame["draw"]:
+        frame["draw"] = False
+        connection.ConnectionView.draw_all()
+
+
+def get_outer_html(element):
+    """ The HTML of a jQuery element, including the element itself """
+    return element[0].outerHTML if element.length else ""
+
+
+def patch_table(old, new):
+    """
+    Replace only the rows of a table that changed. Returns False when the
+    tables have a different header or number of rows and cannot be patched.
+    """
+    if get_outer_html(old.find("> thead")) != get_outer_html(new.find("> thead")):
+        return False
+    old_rows = old.find("> tbody > tr")
+    new_rows = new.find("> tbody > tr")
+    if old_rows.length != new_rows.length:
+        return False
+    for index in range(new_rows.length):
+        if old_rows[index].outerHTML != new_rows[index].outerHTML:
+            old_rows.eq(index).replaceWith(new_rows.eq(index))
+    return True
+
+
+def patch_html(container, html):
+    """
+    Update the HTML in a container, replacing only the elements that changed.
+    The rows of tables with the same header and number of rows are patched
+    one by one. Anything else that changed is replaced as a whole.
+    """
+    new = ltk.create(f"<div>{html}</div>")
+    old_children = container.children()
+    new_children = new.children()
+    if any([
+        old_children.length != new_children.length,
+        container.contents().length != old_children.length,
+        new.contents().length != new_children.length,
+    ]):
+        container.empty().append(new.contents())
+        return
+    for index in range(new_children.length):
+        old = old_children.eq(index)
+        child = new_children.eq(index)
+        if old[0].outerHTML == child[0].outerHTML:
+            continue
+        if old.prop("tagName") == "TABLE" == child.prop("tagName") and patch_table(old, child):
+            continue
+        old.replaceWith(child)
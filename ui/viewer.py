@@ -0,0 +1,160 @@
+"""
+Copyright (c) 2024 laffra - All Rights Reserved.
+
+Shows the rows of a tabular node value, paged from the worker on demand.
+"""
+
+import ltk
+
+
+ROW_HEIGHT = 22
+PAGE_SIZE = 100
+TYPED_ARRAYS = {
+    "<f8": "Float64Array",
+    "<f4": "Float32Array",
+    "<i8": "BigInt64Array",
+    "<u8": "BigUint64Array",
+    "<i4": "Int32Array",
+    "<u4": "Uint32Array",
+    "<i2": "Int16Array",
+    "<u2": "Uint16Array",
+    "|i1": "Int8Array",
+    "|u1": "Uint8Array",
+    "|b1": "Uint8Array",
+}
+
+
+def escape(value):
+    """ Escape a value to show it in a table cell """
+    return str(value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def get_column(column):
+    """
+    Wraps the bytes of a numeric column in a typed array, without parsing them.
+    Other columns are lists of strings already.
+    """
+    if column.dtype in TYPED_ARRAYS:
+        data = column.data.slice()
+        array = getattr(ltk.window, TYPED_ARRAYS[column.dtype])
+        return array.new(data.buffer, 0, data.length // array.BYTES_PER_ELEMENT)
+    return column.data
+
+
+class TableViewer(ltk.VBox):
+    """
+    A virtualized table that only renders the rows that are scrolled into view.
+    Rows are requested from the worker that holds the value, one page at a time.
+    """
+
+    viewers = {}
+
+    def __init__(self, key, worker, send):
+        self.key = key
+        self.worker = worker
+        self.send = send
+        self.pages = {}
+        self.requested = set()
+        self.total = 0
+        self.columns = []
+        self.types = []
+        self.columns_input = ltk.Input("") \
+            .attr("placeholder", "Columns to show, separated by commas") \
+            .on("change", ltk.proxy(lambda event: self.reset()))
+        self.status = ltk.Text("Loading…").addClass("table-viewer-status")
+        self.spacer = ltk.Div().addClass("table-viewer-spacer")
+        self.table = ltk.create("<table border='1' class='dataframe table-viewer-rows'><thead></thead><tbody></tbody></table>")
+        super().__init__(
+            self.columns_input,
+            self.status,
+            ltk.Div(
+                self.spacer,
+                self.table,
+            ).addClass("table-viewer-scroller")
+            .on("scroll", ltk.proxy(lambda event: self.render())),
+        )
+        self.addClass("table-viewer")
+        TableViewer.viewers[key] = self
+
+    def open(self, title):
+        """ Show the viewer in a dialog and load the first page """
+        self.dialog(ltk.to_js({
+            "title": title,
+            "width": 800,
+            "height": 500,
+            "close": ltk.proxy(lambda event, ui: self.close()),
+        }))
+        self.request_page(0)
+
+    def close(self):
+        """ Forget the pages when the dialog is closed """
+        TableViewer.viewers.pop(self.key, None)
+        self.pages = {}
+        self.remove()
+
+    def get_selected_columns(self):
+        """ The columns entered by the user, or None to show all columns """
+        columns = [name.strip() for name in str(self.columns_input.val()).split(",")]
+        return [name for name in columns if name] or None
+
+    def reset(self):
+        """ Drop the loaded pages and load the rows for the selected columns """
+        self.pages = {}
+        self.requested = set()
+        self.find(".table-viewer-scroller").scrollTop(0)
+        self.request_page(0)
+
+    def request_page(self, index):
+        """ Ask the worker for a page of rows, once """
+        if index in self.requested or index * PAGE_SIZE > max(self.total - 1, 0):
+            return
+        self.requested.add(index)
+        self.send(self.worker, "rows", [
+            self.key,
+            index * PAGE_SIZE,
+            PAGE_SIZE,
+            self.get_selected_columns(),
+        ])
+
+    def handle_rows(self, page):
+        """ The worker sent a page of rows """
+        if page.error:
+            self.status.text(page.error)
+            return
+        columns = list(page.columns)
+        if columns != self.columns:
+            self.columns = columns
+            self.types = list(page.types)
+            self.table.find("thead").html("".join([
+                "<tr><th>#</th>", "".join(f"<th>{escape(name)}</th>" for name in self.columns), "</tr>",
+                "<tr class='dtypes'><th></th>", "".join(f"<th>{kind}</th>" for kind in self.types), "</tr>",
+            ]))
+        self.total = page.total
+        self.pages[page.start // PAGE_SIZE] = [get_column(column) for column in page.data]
+        self.status.text(f"{self.total} rows × {len(self.columns)} columns")
+        self.spacer.css("height", f"{(self.total + 2) * ROW_HEIGHT}px")
+        self.render()
+
+    def get_cell(self, row):
+        """ Returns the rendered cells of a row, or None when its page is not loaded """
+        page = self.pages.get(row // PAGE_SIZE)
+        if page is None:
+            return None
+        index = row % PAGE_SIZE
+        return "".join(f"<td>{escape(column[index])}</td>" for column in page)
+
+    def render(self):
+        """ Render only the rows that are scrolled into view, loading their pages as needed """
+        scroller = self.find(".table-viewer-scroller")
+        first = int(scroller.scrollTop() // ROW_HEIGHT)
+        last = min(self.total, first + int(scroller.height() // ROW_HEIGHT) + 1)
+        for index in range(first // PAGE_SIZE, last // PAGE_SIZE + 2):
+            self.request_page(index)
+        rows = []
+        for row in range(first, last):
+            cells = self.get_cell(row)
+            if cells is None:
+                cells = f"<td colspan='{len(self.columns)}'>…</td>"
+            rows.append(f"<tr><th>{row}</th>{cells}</tr>")
+        self.table.css("top", f"{first * ROW_HEIGHT}px")
+        self.table.find("tbody").html("".join(rows))
@@ -0,0 +1,140 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module provides a content-addressed cache for the results of Flow nodes.
+"""
+
+import collections
+import hashlib
+import sys
+
+
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+
+def get_size(value, depth=2):
+    """
+    Approximates the number of bytes held by a value.
+
+    Args:
+        value: The value to measure.
+        depth (int): How deep to descend into containers.
+
+    Returns:
+        int: The approximate size of the value in bytes.
+    """
+    try:
+        return int(value.memory_usage(deep=True).sum())
+    except Exception: # pylint: disable=broad-except
+        pass
+    try:
+        return int(value.nbytes)
+    except Exception: # pylint: disable=broad-except
+        pass
+    try:
+        return value.getbuffer().nbytes
+    except Exception: # pylint: disable=broad-except
+        pass
+    size = sys.getsizeof(value)
+    if depth and isinstance(value, dict):
+        size += sum(get_size(item, depth - 1) for item in value.values())
+    elif depth and isinstance(value, (list, tuple, set)):
+        size += sum(get_size(item, depth - 1) for item in value)
+    return size
+
+
+class ResultCache():
+    """
+    An LRU cache of node results, keyed by the hash of the node's script
+    and the cache keys of its inputs.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(script, input_keys):
+        """
+        Computes the cache key for a script and the cache keys of its inputs.
+        """
+        digest = hashlib.sha256(script.encode("utf-8"))
+        for input_key in input_keys:
+            digest.update(b"\0")
+            digest.update(str(input_key).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, cache_key):
+        """
+        Returns the (value, preview) stored for the cache key, or None.
+        """
+        entry = self.entries.get(cache_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(cache_key)
+        value, preview, _size = entry
+        return value, preview
+
+    def put(self, cache_key, value, preview):
+        """
+        Stores a value and its preview, evicting the least recently used entries
+        when the memory budget is exceeded. Values larger than the budget are not cached.
+        The preview is None when it has not been rendered yet.
+        """
+        self.discard(cache_key)
+        size = get_size(value) + get_size(preview, 0)
+        if size > self.budget:
+            return
+        self.entries[cache_key] = (value, preview, size)
+        self.size += size
+        while self.size > self.budget:
+            self.discard(next(iter(self.entries)))
+
+    def set_preview(self, cache_key, preview):
+        """
+        Stores the preview for a cached value, replacing the preview rendered
+        before, and evicts the least recently used entries when the memory
+        budget is exceeded.
+        """
+        entry = self.entries.get(cache_key)
+        if entry:
+            value, old_preview, size = entry
+            size += get_size(preview, 0) - get_size(old_preview, 0)
+            self.entries[cache_key] = (value, preview, size)
+            self.entries.move_to_end(cache_key)
+            self.size += get_size(preview, 0) - get_size(old_preview, 0)
+            while self.size > self.budget:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, cache_key):
+        """
+        Removes an entry from the cache, if present.
+        """
+        entry = self.entries.pop(cache_key, None)
+        if entry:
+            self.size -= entry[2]
+
+    def set_budget(self, budget):
+        """
+        Changes the memory budget, evicting entries when needed.
+        """
+        self.budget = budget
+        while self.entries and self.size > self.budget:
+            self.discard(next(iter(self.entries)))
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and memory usage of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "size": self.size,
+            "budget": self.budget,
+        }
@@ -0,0 +1,167 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module builds the catalog of node options from the `flows` package.
+
+The catalog is precomputed with:
+
+    python -m worker.catalog
+
+which writes catalog.json, so the UI does not have to wait for an interpreter
+to introspect the flows at startup. When the catalog is stale, the runner
+worker introspects the flows with the same code.
+"""
+
+import collections
+import inspect
+import json
+import os
+import sys
+
+CATALOG_VERSION = 1
+CATALOG_PATH = "catalog.json"
+STUBBED_MODULES = [ "pandas", "duckdb", "matplotlib", "matplotlib.pyplot" ]
+
+
+class Module():
+    """ Placeholder for a module. """
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __getattr__(self, name):
+        return Module(f"{object.__getattribute__(self, '__name__')}.{name}")
+
+    def __str__(self):
+        return self.__name__
+
+
+def get_type_name(annotation):
+    """
+    Get the name of the type of a node.
+    """
+    if callable(annotation):
+        return annotation.__name__
+    return str(annotation)
+
+
+def load_imports(file_path):
+    """
+    Load the imports from a file.
+    """
+    with open(file_path, encoding="utf-8") as file:
+        lines = file.readlines()
+        imports = []
+        for line in lines:
+            if line.startswith("import"):
+                imports.append(line.split("import ")[1].split(" ")[0])
+            elif line.startswith("from"):
+                imports.append(line.split("from ")[1].split(" ")[0])
+        return imports
+
+
+def import_flows():
+    """
+    Imports the `flows` package with placeholders for the heavy packages it
+    refers to, and removes the placeholders and flows modules afterwards, so
+    they do not leak into code that runs later in the same interpreter.
+    """
+    saved = {
+        name: module
+        for name, module in sys.modules.items()
+        if name in STUBBED_MODULES or name == "flows" or name.startswith("flows.")
+    }
+    for name in STUBBED_MODULES:
+        sys.modules[name] = Module(name)
+    try:
+        import flows # pylint: disable=import-outside-toplevel
+        return flows
+    finally:
+        for name in list(sys.modules):
+            if name in STUBBED_MODULES or name == "flows" or name.startswith("flows."):
+                del sys.modules[name]
+        sys.modules.update(saved)
+
+
+def collect_options(flows):
+    """
+    Collect the node options from the modules in the `flows` package.
+    """
+    options = collections.defaultdict(list)
+    category = None
+    for module in flows.__dict__.values():
+        if hasattr(module, "__file__"):
+            if module.__file__:
+                packages = []
+                imports = load_imports(module.__file__)
+                secrets = []
+                category = module.__name__.split(".")[-2]
+                for function_name, function in module.__dict__.items():
+                    if function_name == "packages":
+                        packages = function
+                    elif function_name == "secrets":
+                        secrets = function
+                    elif function_name.startswith("_"):
+                        continue
+                    elif callable(function):
+                        script = inspect.getsource(function)
+                        signature = inspect.signature(function)
+                        parameters = signature.parameters
+                        inputs = [
+                            ( name, get_type_name(param.annotation))
+                            for name, param in parameters.items()
+                        ]
+                        output_type = get_type_name(signature.return_annotation)
+                        options[category].append({
+                            "category": category,
+                            "name": function_name,
+                            "packages": packages,
+                            "secrets": secrets,
+                            "imports": imports,
+                            "inputs": inputs,
+                            "output_type": get_type_name(output_type),
+                            "script": script
+                        })
+    return options
+
+
+def get_files(flows):
+    """
+    Returns the paths of the source files of the `flows` package, relative to the app root.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(flows.__file__)))
+    paths = [flows.__file__] + [
+        module.__file__
+        for module in flows.__dict__.values()
+        if getattr(module, "__file__", None)
+    ]
+    return sorted(set(
+        os.path.relpath(os.path.abspath(path), root).replace(os.sep, "/")
+        for path in paths
+    ))
+
+
+def build():
+    """
+    Builds the versioned catalog of all node options.
+    """
+    flows = import_flows()
+    return {
+        "version": CATALOG_VERSION,
+        "files": get_files(flows),
+        "options": collect_options(flows),
+    }
+
+
+def main():
+    """
+    Writes the catalog to catalog.json.
+    """
+    path = sys.argv[1] if len(sys.argv) > 1 else CATALOG_PATH
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(build(), file, indent=1)
+        file.write("\n")
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module compiles node scripts once and caches the code objects.
+
+A node script consists of imports, secrets, the node function and a call
+to that function. The imports and the other statements are compiled once
+per script hash. Imports only run when their names are missing, function
+and class definitions only run when the name was defined by other code, and
+all other statements, such as assignments and secrets, run every time.
+The call is compiled once per node key, assigning the result of the call
+to the node key.
+"""
+
+import ast
+import collections
+import hashlib
+import sys
+
+
+MAX_SCRIPTS = 256
+
+
+def get_hash(source):
+    """
+    Returns the hash of the given source code.
+    """
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class Program():
+    """
+    The compiled parts of a node script.
+    """
+
+    def __init__(self, imports, definitions, call):
+        self.imports = imports
+        self.definitions = definitions
+        self.call = call
+
+    def run(self, namespace, defined):
+        """
+        Runs the program in the given namespace.
+
+        Args:
+            namespace (dict): The namespace to run the program in.
+            defined (dict): Maps each defined name to the code that defined it.
+        """
+        for modules, code in self.imports:
+            if not all(name in namespace and module in sys.modules for name, module in modules):
+                exec(code, namespace, namespace) # pylint: disable=exec-used
+        for name, code in self.definitions:
+            if name is None or defined.get(name) is not code:
+                exec(code, namespace, namespace) # pylint: disable=exec-used
+            if name is not None:
+                defined[name] = code
+        exec(self.call, namespace, namespace) # pylint: disable=exec-used
+
+
+class CodeCache():
+    """
+    A cache of compiled node scripts, keyed by script hash. Only the most
+    recently used MAX_SCRIPTS scripts and calls are kept, as every edit of a
+    node creates a new script.
+    """
+
+    def __init__(self, max_scripts=MAX_SCRIPTS):
+        self.max_scripts = max_scripts
+        self.scripts = collections.OrderedDict()
+        self.calls = collections.OrderedDict()
+        self.defined = {}
+
+    def compile(self, key, script):
+        """
+        Returns the program for the given script that assigns its last expression to key.
+        """
+        script_hash = get_hash(script)
+        if script_hash not in self.scripts:
+            self.scripts[script_hash] = self.parse(script)
+        self.scripts.move_to_end(script_hash)
+        imports, definitions, last = self.scripts[script_hash]
+        call_key = (script_hash, key)
+        if call_key not in self.calls:
+            self.calls[call_key] = compile(
+                ast.fix_missing_locations(ast.Module(body=self.assign(key, last), type_ignores=[])),
+                f"<{key}>",
+                "exec",
+            )
+        self.calls.move_to_end(call_key)
+        program = Program(imports, definitions, self.calls[call_key])
+        for cache in [self.scripts, self.calls]:
+            while len(cache) > self.max_scripts:
+                cache.popitem(last=False)
+        return program
+
+    def delete(self, key):
+        """
+        Forgets the compiled calls of a deleted node.
+        """
+        for call_key in [call_key for call_key in self.calls if call_key[1] == key]:
+            del self.calls[call_key]
+
+    def run(self, key, script, namespace):
+        """
+        Compiles the given script, if needed, and runs it in the namespace.
+        """
+        self.compile(key, script).run(namespace, self.defined)
+
+    @staticmethod
+    def parse(script):
+        """
+        Splits a script into compiled imports, compiled statements and the last statement.
+        Each function and class definition is paired with its name, other statements with None.
+        """
+        body = ast.parse(script).body if script else []
+        last = body.pop() if body else ast.Pass()
+        imports = []
+        definitions = []
+        for statement in body:
+            if isinstance(statement, (ast.Import, ast.ImportFrom)):
+                imports.append((
+                    CodeCache.get_imported_names(statement),
+                    compile(ast.Module(body=[statement], type_ignores=[]), "<imports>", "exec"),
+                ))
+            else:
+                definitions.append((
+                    statement.name
+                    if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+                    else None,
+                    compile(ast.Module(body=[statement], type_ignores=[]), "<script>", "exec"),
+                ))
+        return imports, definitions, last
+
+    @staticmethod
+    def get_imported_names(statement):
+        """
+        Returns the (name, module) pairs bound by an import statement.
+        """
+        if isinstance(statement, ast.Import):
+            return [
+                ((alias.asname or alias.name).split(".")[0], alias.name)
+                for alias in statement.names
+            ]
+        return [
+            (alias.asname or alias.name, statement.module or "")
+            for alias in statement.names
+        ]
+
+    @staticmethod
+    def assign(key, statement):
+        """ Returns statements that assign the value of the last statement to the key. """
+        target = ast.Name(id=key, ctx=ast.Store())
+        if isinstance(statement, (ast.Expr, ast.Assign)):
+            targets = [target] + getattr(statement, "targets", [])
+            return [ast.copy_location(ast.Assign(targets=targets, value=statement.value), statement)]
+        return [statement, ast.Assign(targets=[target], value=ast.Constant(None))]
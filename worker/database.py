@@ -0,0 +1,309 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module manages the DuckDB connection shared by all nodes in a worker.
+
+The nodes in flows/data use the module-level functions of duckdb, which run
+on DuckDB's default connection. That connection is configured once, with a
+memory limit, a thread count and a directory to spill to, and the tabular
+outputs of nodes are registered on it as views named after the node keys,
+so a SQL node can read and join the outputs of other nodes by name.
+
+DuckDB binds a view by name each time a relation that reads it runs, so the
+view of a released value is kept for as long as the SQL of a node reads it.
+The views and tables created for one value of a node are named after its cache
+key, and are dropped once the runner no longer holds a value with that key.
+"""
+
+import os
+import sys
+import tempfile
+
+from worker.preview import get_type_name
+
+
+ROW_INDEX = "__row__"
+
+settings = {
+    "memory_limit": "1GB",
+    "threads": 1 if sys.platform == "emscripten" else os.cpu_count() or 1,
+    "spill": True,
+}
+views = {}
+references = {}
+released = set()
+owned = {}
+state = {"connection": None, "node": None, "cache_key": None}
+
+
+def get_temp_directory():
+    """
+    Returns the directory DuckDB spills to, in the Pyodide filesystem in the
+    browser, and in the system's temporary directory elsewhere.
+    """
+    if sys.platform == "emscripten":
+        return "/tmp/flow-duckdb"
+    return os.path.join(tempfile.gettempdir(), "flow-duckdb")
+
+
+def quote(name):
+    """
+    Returns the name as a quoted SQL identifier, as node keys contain dashes.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get_connection():
+    """
+    Returns the shared connection, configuring it the first time.
+    DuckDB is only imported when a node that uses it runs.
+    """
+    if state["connection"] is None:
+        import duckdb # pylint: disable=import-error disable=import-outside-toplevel
+        connection = duckdb.default_connection
+        state["connection"] = connection() if callable(connection) else connection
+        apply_settings()
+    return state["connection"]
+
+
+def apply_settings():
+    """
+    Applies the memory limit, thread count and spill directory to the connection.
+    """
+    connection = state["connection"]
+    connection.execute(f"SET memory_limit = '{settings['memory_limit']}'")
+    connection.execute(f"SET threads = {int(settings['threads'])}")
+    if settings["spill"]:
+        os.makedirs(get_temp_directory(), exist_ok=True)
+        connection.execute(f"SET temp_directory = '{get_temp_directory()}'")
+    else:
+        connection.execute("SET temp_directory = ''")
+
+
+def configure(memory_limit=None, threads=None, spill=None):
+    """
+    Changes the settings of the shared connection, applying them right away
+    when the connection exists already.
+
+    Args:
+        memory_limit (str): The maximum memory DuckDB may use, such as "1GB".
+        threads (int): The number of threads DuckDB may use.
+        spill (bool): Whether DuckDB may spill to a temporary directory.
+    """
+    if memory_limit:
+        settings["memory_limit"] = str(memory_limit)
+    if threads:
+        settings["threads"] = int(threads)
+    if spill is not None:
+        settings["spill"] = bool(spill)
+    if state["connection"] is not None:
+        apply_settings()
+
+
+def register(key, value):
+    """
+    Registers the output of a node as a view named after the node key, when it
+    is a DuckDB relation or a DataFrame. Relations stay lazy: the view refers
+    to their query plan. Does nothing when DuckDB was never used, the runner
+    registers the values produced before once DuckDB is loaded.
+
+    Returns:
+        bool: Whether the value was registered.
+    """
+    if state["connection"] is None:
+        return False
+    drop(key)
+    type_name = get_type_name(value)
+    try:
+        if type_name == "duckdb.DuckDBPyRelation":
+            value.create_view(key, replace=True)
+            views[key] = "view"
+        elif type_name == "pandas.DataFrame":
+            state["connection"].register(key, value)
+            views[key] = "frame"
+    except Exception as e: # pylint: disable=broad-except
+        print(f"Cannot register {key} in DuckDB: {e}")
+    return key in views
+
+
+def bind(relation, sql, name="data"):
+    """
+    Runs SQL that reads a relation by name. DuckDB binds the returned relation
+    again each time it runs, so the input is registered as a view named after
+    the running node and the cache key of its value. Two nodes never read each
+    other's input, and a cached relation of an earlier run keeps reading the
+    input it was created for.
+
+    Args:
+        relation: The DuckDB relation to read.
+        sql (str): The SQL query, which refers to the relation by name.
+        name (str): The name of the relation in the query.
+
+    Returns:
+        The DuckDB relation for the query, which is not run yet.
+    """
+    view = own(name, "VIEW")
+    relation.create_view(view, replace=True)
+    binding = f"{name} AS (SELECT * FROM {quote(view)})"
+    sql = sql.strip()
+    words = sql.split(None, 2)
+    if words and words[0].upper() == "WITH":
+        if len(words) > 2 and words[1].upper() == "RECURSIVE":
+            return get_connection().sql(f"WITH RECURSIVE {binding}, {words[2]}")
+        return get_connection().sql(f"WITH {binding}, {sql[4:].lstrip()}")
+    return get_connection().sql(f"WITH {binding} {sql}")
+
+
+def load_table(reader, name="table"):
+    """
+    Loads record batches into a DuckDB table named after the running node and
+    the cache key of its value, one batch at a time.
+
+    Args:
+        reader: A pyarrow RecordBatchReader.
+        name (str): The suffix of the table name.
+
+    Returns:
+        The DuckDB relation for the table.
+    """
+    table = own(name, "TABLE")
+    connection = get_connection()
+    connection.register(f"{table}_batches", reader)
+    try:
+        connection.execute(f"CREATE OR REPLACE TABLE {quote(table)} AS SELECT * FROM {quote(table + '_batches')}")
+    finally:
+        connection.unregister(f"{table}_batches")
+    return connection.table(quote(table))
+
+
+def own(name, kind):
+    """
+    Records a view or table created for the value the running node produces.
+
+    Args:
+        name (str): The suffix of the name.
+        kind (str): Either "VIEW" or "TABLE".
+
+    Returns:
+        str: The name, made of the node key, the suffix and the cache key.
+    """
+    node = state["node"] or "flow"
+    cache_key = state["cache_key"]
+    owned_name = f"{node}__{name}_{cache_key[:16]}" if cache_key else f"{node}__{name}"
+    owned[owned_name] = (kind, node, cache_key)
+    return owned_name
+
+
+def snapshot(relation, node, cache_key):
+    """
+    Materializes a relation into a temporary table with the index of each row,
+    once per value, so the pages of rows read from it by separate queries see
+    the same rows in the same order.
+
+    Args:
+        relation: The DuckDB relation to materialize.
+        node (str): The key of the node that produced the relation.
+        cache_key (str): The cache key of the value.
+
+    Returns:
+        The DuckDB relation for the table, with the row index in column ROW_INDEX.
+    """
+    connection = get_connection()
+    table = f"{node}__rows_{cache_key[:16]}"
+    if table not in owned:
+        relation.project(f"row_number() OVER () - 1 AS {ROW_INDEX}, *").create(quote(table))
+        owned[table] = ("TABLE", node, cache_key)
+    return connection.table(quote(table))
+
+
+def collect(live):
+    """
+    Drops the views and tables created for values whose cache key is not live.
+    Those created outside of a run of a node are only dropped with the node.
+
+    Args:
+        live (set): The cache keys of the values the runner still holds.
+    """
+    for name, (_kind, _node, cache_key) in list(owned.items()):
+        if cache_key and cache_key not in live:
+            drop_owned(name)
+
+
+def drop_owned(name):
+    """
+    Drops a view or table created for the value of a node.
+    """
+    kind = owned.pop(name)[0]
+    if state["connection"] is not None:
+        state["connection"].execute(f"DROP {kind} IF EXISTS {quote(name)}")
+
+
+def query(sql):
+    """
+    Runs SQL that reads the views of other nodes by name. The views whose name
+    occurs in the SQL are kept until the running node runs again or is deleted,
+    as DuckDB binds them again each time the returned relation runs.
+
+    Returns:
+        The DuckDB relation for the query, which is not run yet.
+    """
+    connection = get_connection()
+    set_references(state["node"] or "flow", [key for key in views if key in sql])
+    return connection.sql(sql)
+
+
+def set_references(key, names):
+    """
+    Records the views the SQL of a node reads, and drops the views of released
+    values that are no longer read by any node.
+    """
+    if names:
+        references[key] = set(names)
+    else:
+        references.pop(key, None)
+    for view in list(released):
+        if not is_referenced(view):
+            drop(view)
+
+
+def is_referenced(key):
+    """
+    Returns whether the SQL of another node reads the view of the given node.
+    """
+    return any(key in names for node, names in references.items() if node != key)
+
+
+def delete(key):
+    """
+    Drops the views and tables of a deleted node: the view of its value, the
+    views and tables created for its values, and the released views only its
+    SQL read.
+    """
+    drop(key)
+    for name, (_kind, node, _cache_key) in list(owned.items()):
+        if node == key:
+            drop_owned(name)
+    set_references(key, None)
+
+
+def unregister(key):
+    """
+    Drops the view of a node whose value is no longer held by the worker,
+    unless the SQL of another node reads it.
+    """
+    if key in views and is_referenced(key):
+        released.add(key)
+    else:
+        drop(key)
+
+
+def drop(key):
+    """
+    Drops the view of a node.
+    """
+    released.discard(key)
+    kind = views.pop(key, None)
+    if kind == "view":
+        state["connection"].execute(f"DROP VIEW IF EXISTS {quote(key)}")
+    elif kind == "frame":
+        state["connection"].unregister(key)
@@ -0,0 +1,374 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module caches HTTP responses for the input nodes on disk.
+
+In the browser, the cache directory is backed by IndexedDB, so downloads
+survive reloading the page. Elsewhere, it is a local directory. Fresh entries
+are read from disk without a request. Stale entries are revalidated with
+If-None-Match and If-Modified-Since, so an unchanged file is not downloaded
+again. The least recently used entries are evicted when the cache grows
+beyond its size cap.
+
+A URL is downloaded by one thread at a time, so concurrent requests for it
+share one download, and an entry is never evicted while it is downloaded.
+A stream reads the response while it downloads, and stores the body in the
+cache once it was read to its end.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+settings = {
+    "directory": (
+        "/flow-http-cache"
+        if sys.platform == "emscripten" else
+        os.path.join(tempfile.gettempdir(), "flow-http-cache")
+    ),
+    "ttl": 60 * 60,
+    "max_bytes": 512 * 1024 * 1024,
+    "workers": 4,
+}
+CHUNK_SIZE = 1024 * 1024
+
+state = {"index": None}
+lock = threading.Lock()
+downloads = {}
+
+
+async def mount():
+    """
+    Mounts the cache directory on IndexedDB in the browser and loads the
+    entries stored by earlier sessions. Does nothing outside the browser.
+    """
+    if sys.platform != "emscripten":
+        return
+    import pyodide.ffi # pylint: disable=import-error disable=import-outside-toplevel
+    import pyodide_js # pylint: disable=import-error disable=import-outside-toplevel
+    directory = settings["directory"]
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+        pyodide_js.FS.mount(pyodide_js.FS.filesystems.IDBFS, {}, directory)
+    loaded = asyncio.get_event_loop().create_future()
+    pyodide_js.FS.syncfs(True, pyodide.ffi.create_once_callable(loaded.set_result))
+    await loaded
+    state["index"] = None
+
+
+def persist():
+    """
+    Writes the cache directory back to IndexedDB in the browser, in the background.
+    """
+    if sys.platform == "emscripten":
+        import pyodide.ffi # pylint: disable=import-error disable=import-outside-toplevel
+        import pyodide_js # pylint: disable=import-error disable=import-outside-toplevel
+        pyodide_js.FS.syncfs(False, pyodide.ffi.create_once_callable(lambda error: None))
+
+
+def get_index():
+    """
+    Returns the index of the cache, mapping each URL to its file, validators and timestamps.
+    """
+    if state["index"] is None:
+        try:
+            with open(os.path.join(settings["directory"], "index.json"), encoding="utf-8") as file:
+                state["index"] = json.load(file)
+        except (OSError, ValueError):
+            state["index"] = {}
+    return state["index"]
+
+
+def save_index():
+    """
+    Stores the index of the cache next to the cached files.
+    """
+    os.makedirs(settings["directory"], exist_ok=True)
+    with open(os.path.join(settings["directory"], "index.json"), "w", encoding="utf-8") as file:
+        json.dump(get_index(), file)
+    persist()
+
+
+def evict(keep):
+    """
+    Removes the least recently used entries until the cache fits in its size
+    cap, except for the entry of the given URL, which is about to be read.
+    """
+    index = get_index()
+    total = sum(entry["size"] for entry in index.values())
+    for url, entry in sorted(index.items(), key=lambda item: item[1]["used"]):
+        if total <= settings["max_bytes"]:
+            break
+        if url == keep or url in downloads and downloads[url].locked():
+            continue
+        total -= entry["size"]
+        del index[url]
+        try:
+            os.remove(os.path.join(settings["directory"], entry["file"]))
+        except OSError:
+            pass
+
+
+def get_validators(entry):
+    """
+    Returns the headers that make a request for a cached entry conditional.
+    """
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def is_fresh(entry, now):
+    """
+    Returns whether a cached entry can be used without a request.
+    """
+    return bool(entry) and now - entry["fetched"] <= settings["ttl"]
+
+
+def request(url, entry):
+    """
+    Requests a URL, conditionally when a cached entry has validators.
+
+    Returns:
+        The response, or None when the server reports the entry is unchanged.
+    """
+    try:
+        return urllib.request.urlopen(urllib.request.Request(url, headers=get_validators(entry))) # pylint: disable=consider-using-with
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and entry:
+            return None
+        raise
+
+
+class Download(io.RawIOBase):
+    """
+    A response body that is copied to a temporary file while it is read, and
+    stored in the cache when it was read to its end and closed. A body that
+    is closed early is discarded.
+    """
+
+    def __init__(self, url, response):
+        super().__init__()
+        self.url = url
+        self.response = response
+        self.complete = False
+        os.makedirs(settings["directory"], exist_ok=True)
+        self.output = tempfile.NamedTemporaryFile(dir=settings["directory"], suffix=".part", delete=False) # pylint: disable=consider-using-with
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.response.readinto(buffer)
+        if count:
+            self.output.write(memoryview(buffer)[:count])
+        elif len(buffer):
+            self.complete = True
+        return count
+
+    def finish(self):
+        """
+        Reads the rest of the body and stores it in the cache.
+        """
+        try:
+            shutil.copyfileobj(self.response, self.output)
+            self.complete = True
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.response.close()
+            self.output.close()
+            if self.complete:
+                store(self.url, self.response, self.output.name)
+            else:
+                os.remove(self.output.name)
+        finally:
+            super().close()
+
+
+def store(url, response, part):
+    """
+    Moves a downloaded body into the cache and records it in the index.
+    The headers of the response are looked up in lower case, as pyfetch
+    reports them that way.
+    """
+    now = time.time()
+    file = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    with lock:
+        os.replace(part, os.path.join(settings["directory"], file))
+        get_index()[url] = {
+            "file": file,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "size": os.path.getsize(os.path.join(settings["directory"], file)),
+            "fetched": now,
+            "used": now,
+        }
+        evict(url)
+        save_index()
+
+
+def get_download_lock(url):
+    """
+    Returns the lock that is held while a URL is downloaded.
+    """
+    with lock:
+        return downloads.setdefault(url, threading.Lock())
+
+
+def connect(url):
+    """
+    Finds the cached entry for a URL and requests the URL when the entry is
+    missing or stale. A stale entry is used when the server cannot be reached.
+
+    Returns:
+        tuple: The cached entry, and the response to download, which is None
+        when the cached entry can be used.
+    """
+    with lock:
+        entry = get_index().get(url)
+    now = time.time()
+    if is_fresh(entry, now):
+        return entry, None
+    try:
+        response = request(url, entry)
+    except (urllib.error.URLError, OSError):
+        if not entry:
+            raise
+        return entry, None
+    if response is None:
+        entry = dict(entry, fetched=now)
+    return entry, response
+
+
+def open_cached(url, entry):
+    """
+    Opens the cached copy of a URL and marks it as used. The file is opened
+    while the lock is held, so a concurrent eviction cannot remove it first.
+    """
+    with lock:
+        entry["used"] = time.time()
+        get_index()[url] = entry
+        evict(url)
+        save_index()
+        return open(os.path.join(settings["directory"], entry["file"]), "rb") # pylint: disable=consider-using-with
+
+
+def open_url(url):
+    """
+    Opens the local copy of the response for a URL, downloading it only when
+    there is no fresh copy and the server reports it changed. A stale copy is
+    used when the server cannot be reached.
+
+    Args:
+        url (str): The URL to fetch.
+
+    Returns:
+        A binary file object with the cached response body.
+    """
+    with get_download_lock(url):
+        entry, response = connect(url)
+        if response is not None:
+            Download(url, response).finish()
+            with lock:
+                entry = get_index()[url]
+        return open_cached(url, entry)
+
+
+def open_stream(url):
+    """
+    Opens the response for a URL to be read while it downloads, so the first
+    bytes can be used before the rest arrives. The body is stored in the cache
+    once it was read to its end. A fresh or unchanged cached copy is opened
+    from disk instead.
+
+    Args:
+        url (str): The URL to fetch.
+
+    Returns:
+        A binary file object with the response body.
+    """
+    with get_download_lock(url):
+        entry, response = connect(url)
+        if response is None:
+            return open_cached(url, entry)
+    return io.BufferedReader(Download(url, response), CHUNK_SIZE)
+
+
+def fetch(url):
+    """
+    Returns the response body for a URL, from the cache when possible.
+    """
+    with open_url(url) as file:
+        return file.read()
+
+
+async def fetch_all(urls):
+    """
+    Returns the response bodies for several URLs, requested concurrently:
+    with pyfetch in the browser, where threads run one after the other, and
+    on a pool of threads elsewhere. Each URL is requested once.
+
+    Args:
+        urls (list): The URLs to fetch.
+
+    Returns:
+        list: The response bodies, in the order of the URLs.
+    """
+    unique = list(dict.fromkeys(urls))
+    if sys.platform == "emscripten":
+        bodies = await asyncio.gather(*[fetch_async(url) for url in unique])
+    else:
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ThreadPoolExecutor(settings["workers"]) as executor:
+            bodies = await asyncio.gather(*[loop.run_in_executor(executor, fetch, url) for url in unique])
+    found = dict(zip(unique, bodies))
+    return [found[url] for url in urls]
+
+
+async def fetch_async(url):
+    """
+    Returns the response body for a URL in the browser, from the cache when
+    possible, requesting it with pyfetch so other requests run meanwhile.
+    """
+    import pyodide.http # pylint: disable=import-error disable=import-outside-toplevel
+    with lock:
+        entry = get_index().get(url)
+    now = time.time()
+    if not is_fresh(entry, now):
+        try:
+            response = await pyodide.http.pyfetch(url, headers=get_validators(entry))
+        except OSError:
+            if not entry:
+                raise
+        else:
+            if response.status == 304 and entry:
+                entry = dict(entry, fetched=now)
+            else:
+                response.raise_for_status()
+                os.makedirs(settings["directory"], exist_ok=True)
+                with tempfile.NamedTemporaryFile(dir=settings["directory"], suffix=".part", delete=False) as output:
+                    output.write(await response.bytes())
+                store(url, response, output.name)
+                with lock:
+                    entry = get_index()[url]
+    with open_cached(url, entry) as file:
+        return file.read()
@@ -0,0 +1,212 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module is a client for the Financial Modeling Prep (FMP) API, used by
+the nodes in flows/finance.
+
+Responses are cached per client, which lives as long as the worker:
+- quotes for a short time
+- historical prices that end before today forever, as they do not change
+
+Quotes for many symbols are requested in batches, one request per batch, with
+the batches fetched concurrently by asyncio, using pyfetch in the browser,
+where threads run one after the other. All requests go through a token bucket, so
+re-running a flow does not exhaust the API quota. The base URL can point to a
+local fake FMP server with the FMP_BASE_URL environment variable.
+"""
+
+import asyncio
+import collections
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+
+settings = {
+    "base_url": "https://financialmodelingprep.com/api/v3",
+    "quote_ttl": 60,
+    "recent_ttl": 15 * 60,
+    "rate": 5,
+    "burst": 10,
+    "batch": 50,
+    "entries": 1024,
+}
+clients = {}
+
+
+class TokenBucket():
+    """
+    Limits requests to a rate per second, allowing bursts up to the capacity.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token, which may not be available yet, so callers that come
+        later wait longer.
+
+        Returns:
+            float: The number of seconds to wait before using the token.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0, -self.tokens / self.rate)
+
+    def acquire(self):
+        """
+        Takes a token, waiting until one is available.
+        """
+        time.sleep(self.reserve())
+
+    async def acquire_async(self):
+        """
+        Takes a token, waiting until one is available without blocking other tasks.
+        """
+        await asyncio.sleep(self.reserve())
+
+
+class Client():
+    """
+    A rate-limited, cached FMP client for one API key.
+    """
+
+    def __init__(self, api_key, base_url=None):
+        self.api_key = api_key
+        self.base_url = (base_url or settings["base_url"]).rstrip("/")
+        self.bucket = TokenBucket(settings["rate"], settings["burst"])
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def get_url(self, path, params):
+        """
+        Returns the URL for a path of the API, counting the request.
+        """
+        with self.lock:
+            self.requests += 1
+        return f"{self.base_url}/{path}?{urllib.parse.urlencode(dict(params, apikey=self.api_key))}"
+
+    def request(self, path, **params):
+        """
+        Requests a path of the API and returns the decoded JSON response.
+        """
+        self.bucket.acquire()
+        return load(self.get_url(path, params))
+
+    async def request_async(self, path, **params):
+        """
+        Requests a path of the API without blocking other tasks, and returns
+        the decoded JSON response.
+        """
+        await self.bucket.acquire_async()
+        url = self.get_url(path, params)
+        if sys.platform == "emscripten":
+            import pyodide.http # pylint: disable=import-error disable=import-outside-toplevel
+            response = await pyodide.http.pyfetch(url)
+            response.raise_for_status()
+            return await response.json()
+        return await asyncio.get_running_loop().run_in_executor(None, load, url)
+
+    def get_cached(self, key):
+        """
+        Returns the cached response for a key, or None when it is missing or expired.
+        """
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self.cache[key]
+                return None
+            self.cache.move_to_end(key)
+            return value
+
+    def put_cached(self, key, value, ttl):
+        """
+        Caches a response for ttl seconds, or forever when ttl is None.
+        """
+        with self.lock:
+            self.cache[key] = (None if ttl is None else time.time() + ttl, value)
+            self.cache.move_to_end(key)
+            while len(self.cache) > settings["entries"]:
+                self.cache.popitem(last=False)
+
+    async def quotes(self, symbols):
+        """
+        Returns the quotes for a list of symbols, requesting the symbols that
+        are not cached in batches, concurrently.
+
+        Args:
+            symbols (list): The symbols to quote.
+
+        Returns:
+            list: The quotes, in the order of the symbols that FMP knows.
+        """
+        symbols = [symbol.strip().upper() for symbol in symbols if symbol.strip()]
+        missing = [symbol for symbol in dict.fromkeys(symbols) if self.get_cached(("quote", symbol)) is None]
+        batches = [
+            missing[start:start + settings["batch"]]
+            for start in range(0, len(missing), settings["batch"])
+        ]
+        responses = await asyncio.gather(*[self.request_async(f"quote/{','.join(batch)}") for batch in batches])
+        for response in responses:
+            for quote in response:
+                self.put_cached(("quote", quote["symbol"]), quote, settings["quote_ttl"])
+        quotes = [self.get_cached(("quote", symbol)) for symbol in symbols]
+        return [quote for quote in quotes if quote is not None]
+
+    def history(self, symbol, from_date="", to_date=""):
+        """
+        Returns the daily prices of a symbol. Ranges that end before today
+        are cached forever, more recent ranges for a while.
+
+        Args:
+            symbol (str): The symbol to get the prices for.
+            from_date (str): The first date, as YYYY-MM-DD, or "" for no limit.
+            to_date (str): The last date, as YYYY-MM-DD, or "" for today.
+
+        Returns:
+            list: The daily prices, most recent first.
+        """
+        key = ("history", symbol.upper(), from_date, to_date)
+        prices = self.get_cached(key)
+        if prices is None:
+            params = {name: value for name, value in [("from", from_date), ("to", to_date)] if value}
+            response = self.request(f"historical-price-full/{symbol.upper()}", **params)
+            prices = response.get("historical", []) if isinstance(response, dict) else response
+            past = to_date and to_date < datetime.date.today().isoformat()
+            self.put_cached(key, prices, None if past else settings["recent_ttl"])
+        return prices
+
+
+def load(url):
+    """
+    Requests a URL and returns the decoded JSON response.
+    """
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def get_client(api_key):
+    """
+    Returns the client for an API key, so its cache is shared by all runs in the worker.
+    """
+    base_url = os.environ.get("FMP_BASE_URL") or settings["base_url"]
+    if (api_key, base_url) not in clients:
+        clients[(api_key, base_url)] = Client(api_key, base_url)
+    return clients[(api_key, base_url)]
@@ -0,0 +1,61 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module loads the packages declared by nodes on demand, the first time
+a node that needs them is scheduled.
+"""
+
+import asyncio
+
+
+WARM_PACKAGES = [ "pandas" ]
+
+
+class PackageLoader():
+    """
+    Loads packages into the worker with micropip, at most once per package.
+    Independent packages are loaded in parallel.
+    """
+
+    def __init__(self):
+        self.loading = {}
+        self.installer = None
+
+    async def get_installer(self):
+        """ Returns micropip, loading it the first time. """
+        if self.installer is None:
+            import pyodide_js # pylint: disable=import-error disable=import-outside-toplevel
+            await pyodide_js.loadPackage("micropip")
+            import micropip # pylint: disable=import-error disable=import-outside-toplevel
+            self.installer = micropip
+        return self.installer
+
+    async def install(self, package):
+        """
+        Installs a single package. A failed install is forgotten, so the
+        next node that needs the package tries again.
+        """
+        try:
+            installer = await self.get_installer()
+            print("Loading package", package)
+            await installer.install(package)
+        except Exception:
+            self.loading.pop(package, None)
+            raise
+
+    def load(self, package):
+        """ Returns the task that loads a package, starting it when needed. """
+        if package not in self.loading:
+            self.loading[package] = asyncio.ensure_future(self.install(package))
+        return self.loading[package]
+
+    async def ensure(self, packages):
+        """ Waits until all the given packages are loaded. """
+        tasks = [self.load(package) for package in packages or []]
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    def prefetch(self, packages=None):
+        """ Starts loading packages in the background. """
+        for package in WARM_PACKAGES if packages is None else packages:
+            self.load(package)
@@ -5,122 +5,534 @@ This module creates a preview for a Flow node.
 """
 
 
-import base64
+import collections
+import hashlib
+import html
+import importlib
 import io
+import itertools
 import json
-import matplotlib
+import sys
+import time
 
-def get_image_data(figure):
+settings = {
+    "max_bytes": 64 * 1024,
+    "rows": 10,
+    "images": 32,
+    "depth": 3,
+    "keys": 20,
+    "chars": 16 * 1024,
+    "leaf": 200,
+    "max_ms": 250,
+    "retry": 10,
+}
+images = {
+    "backend": False,
+    "png": collections.OrderedDict(),
+}
+
+
+def get_class_name(module, name):
     """
-    Converts a Matplotlib figure to an HTML image representation.
-    
+    Returns the name of a class as its top-level package and class name, such
+    as "pandas.DataFrame". Libraries move their classes between modules across
+    versions, such as "pandas.core.frame" in pandas 2 and "_duckdb" in DuckDB 1.4,
+    so the modules in between are left out, as is a leading underscore.
+    """
+    return f"{module.split('.')[0].lstrip('_')}.{name}"
+
+
+def get_type_name(result):
+    """
+    Returns the name of the type of a result, see `get_class_name`, without importing its module.
+    """
+    return get_class_name(type(result).__module__, type(result).__name__)
+
+
+def get_html_table(columns, types, rows):
+    """
+    Generates an HTML table with a header row of column names and their types.
+
+    Args:
+        columns (list): The names of the columns.
+        types (list): The types of the columns.
+        rows (list): The rows to show, a row of None values is shown as an ellipsis.
+
+    Returns:
+        str: An HTML table.
+    """
+    def cell(value, tag="td"):
+        return f"<{tag}>{'…' if value is None else html.escape(str(value))}</{tag}>"
+    return "".join([
+        "<table border='1' class='dataframe'>",
+            "<thead>",
+                "<tr>", "".join(cell(column, "th") for column in columns), "</tr>",
+                "<tr class='dtypes'>", "".join(cell(kind, "th") for kind in types), "</tr>",
+            "</thead>",
+            "<tbody>",
+                "".join(
+                    f"<tr>{''.join(cell(value) for value in row)}</tr>"
+                    for row in rows
+                ),
+            "</tbody>",
+        "</table>",
+    ])
+
+
+def fit(render, rows, max_bytes):
+    """
+    Renders a preview with the given number of rows, halving the rows until
+    the preview fits in max_bytes.
+
+    Args:
+        render (callable): Renders the preview for a number of rows.
+        rows (int): The maximum number of rows to render.
+        max_bytes (int): The size budget for the preview.
+
+    Returns:
+        str: The preview, or None when even a single row does not fit.
+    """
+    while rows > 0:
+        preview = render(rows)
+        if len(preview.encode("utf-8")) <= max_bytes:
+            return preview
+        rows //= 2
+    return None
+
+
+def get_dataframe_preview(frame, max_bytes=None, rows=None):
+    """
+    Creates a preview of a pandas DataFrame with its row count, column types
+    and head/tail rows, without rendering the full data.
+
+    Args:
+        frame (pandas.DataFrame): The DataFrame to preview.
+        max_bytes (int): The size budget for the preview.
+        rows (int): The number of head and tail rows to show.
+
+    Returns:
+        str: An HTML preview of the DataFrame.
+    """
+    max_bytes = max_bytes or settings["max_bytes"]
+    count, width = frame.shape
+    summary = f"<div class='preview-summary'>DataFrame: {count:,} rows × {width} columns</div>"
+    columns = [str(column) for column in frame.columns[:50]]
+    types = [str(kind) for kind in frame.dtypes[:50]]
+
+    def render(rows):
+        if count <= 2 * rows:
+            return summary + get_html_table(columns, types, frame.iloc[:, :50].itertuples(index=False))
+        head = frame.iloc[:rows, :50].itertuples(index=False)
+        tail = frame.iloc[-rows:, :50].itertuples(index=False)
+        return summary + get_html_table(columns, types, [*head, [None] * len(columns), *tail])
+
+    return fit(render, rows or settings["rows"], max_bytes) or summary
+
+
+def get_relation_preview(relation, max_bytes=None, rows=None):
+    """
+    Creates a preview of a DuckDB relation from its column metadata and a LIMIT
+    query, so the full relation is never computed.
+
+    Args:
+        relation (duckdb.DuckDBPyRelation): The relation to preview.
+        max_bytes (int): The size budget for the preview.
+        rows (int): The number of rows to show.
+
+    Returns:
+        str: An HTML preview of the relation.
+    """
+    max_bytes = max_bytes or settings["max_bytes"]
+    rows = rows or settings["rows"]
+    columns = list(relation.columns)
+    types = [str(kind) for kind in relation.types]
+    sample = relation.limit(rows + 1).fetchall()
+    count = f"{len(sample)} rows" if len(sample) <= rows else f"more than {rows} rows"
+    summary = f"<div class='preview-summary'>DuckDB relation: {count} × {len(columns)} columns</div>"
+
+    def render(rows):
+        more = [[None] * len(columns)] if len(sample) > rows else []
+        return summary + get_html_table(columns, types, sample[:rows] + more)
+
+    return fit(render, rows, max_bytes) or summary
+
+
+def use_agg_backend():
+    """
+    Use the built-in agg backend, once.
+    This reduces rendering time for plots from ~6s to 70ms
+    """
+    import matplotlib # pylint: disable=import-outside-toplevel
+    if not images["backend"]:
+        matplotlib.use("agg")
+        images["backend"] = True
+    import matplotlib.pyplot # pylint: disable=import-outside-toplevel
+    return matplotlib
+
+
+def get_image_data(figure, view=None):
+    """
+    Converts a Matplotlib figure to a PNG image preview, sized to match the
+    node's box on screen. The figure is drawn once and identical drawings
+    reuse the PNG bytes that were encoded before.
+
     Args:
         figure (matplotlib.figure.Figure): The Matplotlib figure to convert.
-    
+        view (dict): The width, height and pixel ratio of the node's preview.
+
     Returns:
-        str: An HTML string representing the figure as an image.
-    """
-    #
-    # Use the built-in agg backend.
-    # This reduces rendering time for plots from ~6s to 70ms
-    #
-    matplotlib.use("agg")
-    bytes_io = io.BytesIO()
+        dict: A preview of kind "image" with the raw PNG bytes and their hash.
+    """
+    matplotlib = use_agg_backend()
+    view = view or {}
+    dpi = 100 * view.get("ratio", 1)
+    figure.set_dpi(dpi)
+    if view.get("width") and view.get("height"):
+        figure.set_size_inches(view["width"] / 100, view["height"] / 100)
     figure.set_edgecolor("#BBB")
-    figure.savefig(bytes_io, bbox_inches="tight", format="png")
-    bytes_io.seek(0)
+    canvas = figure.canvas
+    canvas.draw()
+    pixels = canvas.buffer_rgba()
+    digest = hashlib.md5(pixels).hexdigest()
+    if digest in images["png"]:
+        images["png"].move_to_end(digest)
+    else:
+        bytes_io = io.BytesIO()
+        matplotlib.pyplot.imsave(bytes_io, pixels, format="png", dpi=dpi)
+        images["png"][digest] = bytes_io.getvalue()
+        while len(images["png"]) > settings["images"]:
+            images["png"].popitem(last=False)
     matplotlib.pyplot.close(figure)
-    encoded = base64.b64encode(bytes_io.read())
-    return f"""<img src="data:image/png;base64,{encoded.decode('utf-8')}">"""
+    return {
+        "kind": "image",
+        "mime": "image/png",
+        "hash": digest,
+        "data": images["png"][digest],
+    }
 
-def get_dict_table(result):
+def get_plotly_figure(figure):
     """
-    Recursively generates an HTML table representation of a dictionary.
-    
+    Converts a Plotly figure to a compact preview that the UI renders with the
+    plotly.js runtime, which the main page loads for the first Plotly preview.
+
     Args:
-        result (dict): The dictionary to be represented as an HTML table.
-    
+        figure (plotly.graph_objects.Figure): The Plotly figure to convert.
+
     Returns:
-        str: An HTML table representation of the input dictionary.
+        dict: A preview of kind "plotly" with the figure as JSON.
+    """
+    return {
+        "kind": "plotly",
+        "figure": figure.to_json(),
+    }
+
+def get_leaf(value):
+    """
+    Returns the escaped text of a value in a tree preview, cut off at the leaf budget.
+    """
+    try:
+        text = json.dumps(value)
+    except Exception: # pylint: disable=broad-except
+        text = repr(value)
+    if len(text) > settings["leaf"]:
+        text = text[:settings["leaf"]] + "…"
+    return html.escape(text)
+
+
+def get_more(path, offset, label):
+    """
+    Returns a placeholder for the items of a tree preview that were not rendered.
+    The UI sends the path and offset back to the worker to expand it.
     """
-    if not isinstance(result, dict):
-        raise ValueError(f"Expected a dict, got {type(result)}")
     return "".join([
-        "<table border='1' class='dict_table'>",
-            "<thead>",
-                "<tr><th>key</th><th>value</th></tr>",
-            "</thead>",
-            "<tbody>",
-                "".join(f"<tr><td>{key}</td><td>{get_dict_table(value)}</td></tr>" for key, value in result.items()),
-            "</thead>",
-        "</table>",
+        "<span class='preview-more' ",
+        f"data-path='{json.dumps(path)}' data-offset='{offset}'>",
+        html.escape(label),
+        "</span>",
+    ])
+
+
+def get_child(value, index):
+    """
+    Returns the item at the given position of a dict, list or tuple.
+    """
+    items = value.values() if isinstance(value, dict) else value
+    return next(itertools.islice(items, index, None))
+
+
+def iter_tree(value, path, offset, budget, depth=0):
+    """
+    Generates the HTML of a tree preview for nested dicts, lists and tuples.
+
+    At most settings["keys"] items are rendered per level and containers deeper
+    than settings["depth"] levels are collapsed. Once the character budget is
+    used up, the remaining items of each level are replaced by a placeholder,
+    so the generator stops early without walking the rest of the value.
+
+    Args:
+        value: The value to render.
+        path (list): The positions of the value inside the node's value.
+        offset (int): The position of the first item to render.
+        budget (list): The number of characters that can still be rendered.
+        depth (int): The nesting level of the value.
+
+    Yields:
+        str: Chunks of HTML.
+    """
+    if not isinstance(value, (dict, list, tuple)):
+        leaf = get_leaf(value)
+        budget[0] -= len(leaf)
+        yield leaf
+        return
+    items = value.items() if isinstance(value, dict) else enumerate(value)
+    yield "<table border='1' class='dict_table'><tbody>"
+    index = offset
+    for index, (key, item) in enumerate(itertools.islice(items, offset, None), offset):
+        if budget[0] <= 0 or index - offset >= settings["keys"]:
+            break
+        row = f"<tr><td>{html.escape(str(key))}</td><td>"
+        budget[0] -= len(row)
+        yield row
+        if isinstance(item, (dict, list, tuple)) and item and depth + 1 >= settings["depth"]:
+            yield get_more(path + [index], 0, f"{type(item).__name__} with {len(item)} items…")
+        else:
+            yield from iter_tree(item, path + [index], 0, budget, depth + 1)
+        yield "</td></tr>"
+    else:
+        index = len(value)
+    if index < len(value):
+        yield f"<tr><td colspan='2'>{get_more(path, index, f'{len(value) - index} more…')}</td></tr>"
+    yield "</tbody></table>"
+
+
+def get_tree_preview(value, path=None, offset=0):
+    """
+    Creates a depth and size limited HTML preview of nested dicts, lists and tuples.
+
+    Args:
+        value: The value of the node.
+        path (list): The positions of the part of the value to render.
+        offset (int): The position of the first item to render.
+
+    Returns:
+        str: An HTML preview with placeholders for the items that were left out.
+    """
+    path = list(path or [])
+    for index in path:
+        value = get_child(value, index)
+    return "".join(iter_tree(value, path, offset, [settings["chars"]]))
+
+
+def get_sequence_preview(result, _view=None):
+    """
+    Creates a preview of a list or tuple with its length and a bounded tree of its items.
+    """
+    summary = f"<div class='preview-summary'>{type(result).__name__} with {len(result):,} items</div>"
+    return summary + get_tree_preview(result)
+
+
+def get_fallback_preview(result, _view=None):
+    """
+    Creates a preview for a type without a renderer, from its HTML representation,
+    its buffer size or its repr. Nothing is rendered more than once.
+    """
+    if hasattr(result, "_repr_html_"):
+        preview = result._repr_html_() # pylint: disable=protected-access
+        if preview:
+            return preview
+    if hasattr(result, "getbuffer"):
+        return f"{result.getbuffer().nbytes} bytes"
+    return f"<pre>{html.escape(repr(result)[:settings['max_bytes']])}</pre>"
+
+
+def register(type_name, renderer):
+    """
+    Registers a renderer for values of the type with the given name, and its
+    subclasses. Registering by name avoids importing the module of the type.
+
+    Args:
+        type_name (str): The name of the type, such as "pandas.DataFrame". A fully
+            qualified name, such as "pandas.core.frame.DataFrame", works as well.
+        renderer: A function that is called with a value and the view of its node and
+            returns the preview, or a "module:function" string that is imported when
+            a value of the type is previewed for the first time.
+    """
+    module, _, name = type_name.rpartition(".")
+    renderers[get_class_name(module, name)] = renderer
+    dispatch.clear()
+
+
+def get_renderer(result):
+    """
+    Returns the name of the type a renderer was registered for and the renderer
+    for the given value, found by walking the method resolution order of its type.
+    """
+    kind = type(result)
+    if kind not in dispatch:
+        dispatch[kind] = (get_type_name(result), get_fallback_preview)
+        for cls in kind.__mro__:
+            type_name = get_class_name(cls.__module__, cls.__name__)
+            if type_name in renderers:
+                dispatch[kind] = (type_name, renderers[type_name])
+                break
+    type_name, renderer = dispatch[kind]
+    if isinstance(renderer, str):
+        module, function = renderer.split(":")
+        renderer = getattr(importlib.import_module(module), function)
+        renderers[type_name] = renderer
+        dispatch[kind] = (type_name, renderer)
+    return type_name, renderer
+
+
+def get_timings():
+    """
+    Returns the number of previews, failures, overruns and seconds spent per renderer type.
+    """
+    return {
+        type_name: dict(timing)
+        for type_name, timing in timings.items()
+    }
+
+
+def get_memory(result):
+    """
+    Returns the shallow memory size of a value, without scanning its contents.
+    """
+    try:
+        return int(result.memory_usage(deep=False).sum())
+    except Exception: # pylint: disable=broad-except
+        pass
+    try:
+        return int(result.nbytes)
+    except Exception: # pylint: disable=broad-except
+        return sys.getsizeof(result)
+
+
+def get_summary(result, reason):
+    """
+    Creates a cheap preview that shows only the type, shape and memory size of a value.
+    Lazy values, such as DuckDB relations, are not computed to find their shape.
+
+    Args:
+        result: The value to summarize.
+        reason (str): Why the full preview was not rendered.
+
+    Returns:
+        str: An HTML summary of the value.
+    """
+    parts = [html.escape(type(result).__name__)]
+    if get_type_name(result) == "duckdb.DuckDBPyRelation":
+        parts.append(f"{len(result.columns)} columns")
+    elif isinstance(getattr(result, "shape", None), tuple):
+        parts.append(" × ".join(f"{size:,}" for size in result.shape))
+    elif hasattr(result, "__len__"):
+        parts.append(f"{len(result):,} items")
+    parts.append(f"{get_memory(result):,} bytes")
+    return "".join([
+        f"<div class='preview-summary'>{' | '.join(parts)}</div>",
+        f"<i>{html.escape(reason)}</i>",
     ])
 
 
-def create_preview(result): # pylint: disable=too-many-return-statements
+def get_size_bucket(result):
+    """
+    Returns the size class of a value, from its shallow memory size. Classes are
+    a factor 16 apart, so a slow preview of a large value does not degrade the
+    previews of smaller values of the same type.
+    """
+    return get_memory(result).bit_length() // 4
+
+
+def is_degraded(budget):
+    """
+    Returns whether previews of a type and size class are replaced by a summary,
+    because its renderer ran over the time budget. Every settings["retry"]
+    previews, the renderer is tried again, in case the values got faster.
+    """
+    if not budget["overran"]:
+        return False
+    budget["degraded"] += 1
+    return budget["degraded"] % settings["retry"] != 0
+
+
+def create_preview(result, view=None):
     """
     Creates a preview of the given result object.
     
     The preview can be in the form of an HTML representation, an image, or a
-    string representation, depending on the type of the result object.
+    string representation, depending on the type of the result object. The
+    renderer is looked up by type, see `register`. When it fails, the
+    preview falls back to the representation of the value.
+
+    A renderer cannot be interrupted, so a renderer that runs over the
+    settings["max_ms"] time budget is recorded and the next previews of its
+    type and size class are a cheap summary. HTML previews larger than settings["max_bytes"]
+    are replaced by a summary too.
     
     Args:
         result: The result object to create a preview for.
+        view (dict): The size of the node's preview on screen.
     
     Returns:
-        A string representation of the preview.
-    """
-    if isinstance(result, (str, int, float)):
-        return result
-    if isinstance(result, (tuple, list)):
-        if len(result) > 100:
-            first = json.dumps(result[:50], indent=4)
-            last = json.dumps(result[-50:], indent=4)
-            preview = f"{first[:-2]}\n    ...\n{last[2:]}"
-        else:
-            preview = json.dumps(result, indent=4)
-        return f"{result.__class__.__name__} with {len(result)} items: <pre>{preview}</pre>"
-    if str(result) == "DataFrame":
-        return str(result)
-    if "plotly" in str(type(result)):
-        try:
-            import plotly # pylint: disable=import-outside-toplevel
-            html = plotly.io.to_html(result, default_width=500, default_height=500)
-            return html
-        except ImportError:
-            pass
-    try:
-        return get_image_data(result)
-    except Exception: # pylint: disable=broad-except
-        pass  # print(traceback.format_exc())
-    try:
-        return get_image_data(result.get_figure())
-    except Exception: # pylint: disable=broad-except
-        pass  # print(traceback.format_exc())
-    try:
-        return result._repr_html_() # pylint: disable=protected-access
-    except Exception: # pylint: disable=broad-except
-        pass  # print(traceback.format_exc())
-    try:
-        html = io.StringIO()
-        result.save(html, "html")
-        return html.getvalue()
-    except Exception: # pylint: disable=broad-except
-        pass  # traceback.print_exc()
-    try:
-        return get_dict_table(result)
-    except Exception: # pylint: disable=broad-except
-        pass  # print(traceback.format_exc())
-    try:
-        return f"{result.getbuffer().nbytes} bytes"
-    except Exception: # pylint: disable=broad-except
-        pass  # print(traceback.format_exc())
-    try:
-        return json.dumps({result})
-    except Exception: # pylint: disable=broad-except
-        pass  # print(traceback.format_exc())
+        A string representation of the preview, or a dict with a "kind"
+        for previews that the UI renders itself.
+    """
+    start = time.perf_counter()
+    type_name = get_type_name(result)
+    preview = None
     try:
-        return repr(result)
+        type_name, renderer = get_renderer(result)
+        budget = budgets[(type_name, get_size_bucket(result))]
+        if is_degraded(budget):
+            timings[type_name]["degraded"] += 1
+            return get_summary(result, f"Rendering took {budget['elapsed'] * 1000:.0f}ms before.")
+        preview = renderer(result, view)
     except Exception: # pylint: disable=broad-except
-        pass  # print(traceback.format_exc())
-    return f"<pre>&lt;{type(result).__name__}&gt;<pre>"
+        timings[type_name]["failures"] += 1
+    if preview is None:
+        preview = get_fallback_preview(result)
+    elapsed = time.perf_counter() - start
+    timing = timings[type_name]
+    timing["count"] += 1
+    timing["seconds"] += elapsed
+    timing["slowest"] = max(timing["slowest"], elapsed)
+    budget = budgets[(type_name, get_size_bucket(result))]
+    budget["elapsed"] = elapsed
+    budget["overran"] = elapsed * 1000 > settings["max_ms"]
+    if budget["overran"]:
+        timing["overruns"] += 1
+    if isinstance(preview, str) and len(preview) > settings["max_bytes"]:
+        timing["oversized"] += 1
+        preview = get_summary(result, f"The preview of {len(preview):,} characters is too large.")
+    return preview
+
+
+renderers = {}
+dispatch = {}
+timings = collections.defaultdict(lambda: {
+    "count": 0,
+    "failures": 0,
+    "seconds": 0.0,
+    "slowest": 0.0,
+    "overruns": 0,
+    "degraded": 0,
+    "oversized": 0,
+})
+budgets = collections.defaultdict(lambda: {
+    "overran": False,
+    "degraded": 0,
+    "elapsed": 0.0,
+})
+
+register("builtins.str", lambda result, view: result)
+register("builtins.int", lambda result, view: result)
+register("builtins.float", lambda result, view: result)
+register("builtins.list", get_sequence_preview)
+register("builtins.tuple", get_sequence_preview)
+register("builtins.dict", lambda result, view: get_tree_preview(result))
+register("pandas.DataFrame", lambda result, view: get_dataframe_preview(result))
+register("duckdb.DuckDBPyRelation", lambda result, view: get_relation_preview(result))
+register("matplotlib.Figure", get_image_data)
+register("matplotlib._AxesBase", lambda result, view: get_image_data(result.get_figure(), view))
+register("plotly.BaseFigure", lambda result, view: get_plotly_figure(result))
+register("worker.CsvStream", "worker.stream:get_preview")
@@ -0,0 +1,97 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module reads pages of rows from tabular node values for the table viewer.
+
+Numeric columns are sent as the raw bytes of their NumPy buffer, together
+with their dtype, so the UI can wrap them in a typed array without parsing.
+Other columns are sent as lists of strings.
+"""
+
+from worker.database import ROW_INDEX
+from worker.preview import get_type_name
+
+MAX_ROWS = 1000
+NUMERIC_KINDS = "iufb"
+
+
+def get_column(array):
+    """
+    Converts a NumPy array to a column of the page.
+
+    Args:
+        array (numpy.ndarray): The values of the column for the rows in the page.
+
+    Returns:
+        dict: The dtype of the column and its data, as bytes for numeric columns.
+    """
+    if array.dtype.kind in NUMERIC_KINDS and not hasattr(array, "mask"):
+        array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+        return {"dtype": array.dtype.str, "data": array.tobytes()}
+    return {"dtype": "str", "data": [str(value) for value in array]}
+
+
+def get_frame_rows(frame, start, count, columns):
+    """
+    Reads a page of rows from a pandas DataFrame.
+    """
+    names = [str(column) for column in frame.columns]
+    selected = [index for index, name in enumerate(names) if not columns or name in columns]
+    page = frame.iloc[start:start + count, selected]
+    return {
+        "total": len(frame),
+        "columns": [names[index] for index in selected],
+        "types": [str(kind) for kind in page.dtypes],
+        "data": [get_column(page.iloc[:, index].to_numpy()) for index in range(len(selected))],
+    }
+
+
+def get_relation_rows(relation, start, count, columns, total):
+    """
+    Reads a page of rows from a DuckDB relation. A relation without an order
+    may return its rows in a different order each time it runs, so a snapshot
+    made by database.snapshot is paged by its row index. The row count is only
+    computed when it is not known yet.
+    """
+    if total is None:
+        total = relation.aggregate("count(*)").fetchone()[0]
+    names = [name for name in relation.columns if name != ROW_INDEX and (not columns or name in columns)]
+    if ROW_INDEX in relation.columns:
+        relation = relation.filter(f"{ROW_INDEX} >= {start} AND {ROW_INDEX} < {start + count}").order(ROW_INDEX)
+    else:
+        relation = relation.limit(count, offset=start)
+    relation = relation.select(*[f'"{name}"' for name in names])
+    arrays = relation.fetchnumpy()
+    return {
+        "total": total,
+        "columns": list(relation.columns),
+        "types": [str(kind) for kind in relation.types],
+        "data": [get_column(arrays[name]) for name in relation.columns],
+    }
+
+
+def get_rows(value, start, count, columns=None, total=None):
+    """
+    Reads a page of rows from a tabular node value.
+
+    Args:
+        value: A pandas DataFrame or a DuckDB relation.
+        start (int): The index of the first row in the page.
+        count (int): The number of rows in the page, at most MAX_ROWS.
+        columns (list): The names of the columns to read, or None for all columns.
+        total (int): The number of rows of the value, when known from an earlier page.
+
+    Returns:
+        dict: The total number of rows, the names and types of the columns and their data.
+    """
+    start = max(0, int(start))
+    count = max(0, min(int(count), MAX_ROWS))
+    type_name = get_type_name(value)
+    if type_name == "pandas.DataFrame":
+        page = get_frame_rows(value, start, count, columns)
+    elif type_name == "duckdb.DuckDBPyRelation":
+        page = get_relation_rows(value, start, count, columns, total)
+    else:
+        raise TypeError(f"Cannot show the rows of a {type(value).__name__}")
+    page["start"] = start
+    return page
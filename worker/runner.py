@@ -5,12 +5,37 @@ This module provides a worker for a PyScript-based application to run Python
 code, find dependencies, and perform code completion.
 """
 
-import ast
+import asyncio
+import collections
+import inspect
 import json
 import time
 
 import polyscript # pylint: disable=import-error
+from worker import cache as result_cache
+from worker import catalog
+from worker import compiler
+from worker import database
+from worker import fetch
+from worker import packages as worker_packages
 from worker import preview
+from worker import rows
+from worker import state as worker_state
+from worker import transport
+
+def get_worker_name():
+    """ Returns the name this worker was registered with by the main thread. """
+    config = getattr(polyscript, "config", None)
+    if hasattr(config, "to_py"):
+        config = config.to_py()
+    return (config or {}).get("worker_name", "pyodide-runner")
+
+
+WORKER = get_worker_name()
+TOPICS = [
+    "run", "run_batch", "settings", "delete", "pin", "send_value", "receive_value",
+    "prefetch", "options", "preview", "expand", "rows",
+]
 
 state = {}
 state.update(globals())
@@ -21,54 +46,434 @@ state.update({
     )
 })
 
+cache = result_cache.ResultCache()
+cache_keys = {}
+refreshes = collections.Counter()
+generations = collections.Counter()
+tasks = {}
+previews = collections.OrderedDict()
+row_counts = {}
+preview_task = None
+MISSING = object()
+tracker = worker_state.StateTracker(state, cache)
+code_cache = compiler.CodeCache()
+loader = worker_packages.PackageLoader()
+
+
 class Runner():
     """ Runner class for running Python code. """
 
-    def __init__(self, key, script):
+    def __init__(self, key, script, inputs=None, force=False, view=None): # pylint: disable=too-many-arguments
         """ Runs the script. """
         self.start = time.time()
         self.key = key
+        self.inputs = inputs or []
+        self.view = view or {}
+        if force:
+            refreshes[key] += 1
+        self.cache_key = cache.get_key(script, [
+            refreshes[key],
+            *[cache_keys.get(input_key, input_key) for input_key in self.inputs],
+        ])
         print("="*30)
         print(script)
         print("="*30)
-        self.script = self.intercept_last_expression(key, script)
+        self.script = script
 
-    def run(self):
-        """ Runs the script. """
+    def is_current(self, generation):
+        """ Returns whether this run was not superseded by a newer run of the same node. """
+        return generations[self.key] == generation
+
+    async def run(self, generation):
+        """
+        Runs the script, unless its result is already cached. Awaits the result
+        of async node functions. Returns whether the run succeeded, or None when
+        the run was superseded and its result was discarded.
+
+        Publishes "done" as soon as the value is available, so downstream nodes
+        can be scheduled. The preview is rendered later, see `queue_preview`.
+        """
+        entry = cache.get(self.cache_key)
+        if entry:
+            value, result_preview = entry
+            state[self.key] = value
+            self.produced()
+            publish("done", self.key)
+            if result_preview is None:
+                queue_preview(self.key, self.cache_key, value, self.view)
+            else:
+                publish("preview", [self.key, transport.to_js(result_preview)])
+            return True
         try:
-            exec(self.script, state, state) # pylint: disable=exec-used
-            publish("result", [self.key, preview.create_preview(state[self.key])])
+            self.restore_inputs()
+            database.state["node"] = self.key
+            database.state["cache_key"] = self.cache_key
+            code_cache.run(self.key, self.script, state)
+            value = state[self.key]
+            if inspect.isawaitable(value):
+                value = await value
+                if not self.is_current(generation):
+                    return None
+                state[self.key] = value
+            cache.put(self.cache_key, value, None)
+            self.produced()
+            publish("done", self.key)
+            queue_preview(self.key, self.cache_key, value, self.view)
+            return True
         except Exception as e: # pylint: disable=broad-exception-caught
+            cache_keys.pop(self.key, None)
             lineno = e.__traceback__.tb_lineno
             publish("error", [self.key, f"Line {lineno}, {type(e).__name__}: {e}"])
             print(e)
+            return False
+
+    def restore_inputs(self):
+        """ Restores inputs that were released from the state, using the result cache. """
+        for input_key in self.inputs:
+            if input_key in state:
+                continue
+            entry = cache.get(cache_keys.get(input_key))
+            if entry is None:
+                raise ValueError(f"The result of {input_key} was released, please rerun it")
+            state[input_key] = entry[0]
+            tracker.restored(input_key, self.key, cache_keys[input_key])
 
-    def intercept_last_expression(self, key, script):
-        """ Assigns the last expression in the given Python script to `_`. """
-        if not script:
-            return ""
-        tree = ast.parse(script)
-        last = tree.body[-1]
-        lines = script.split("\n")
-        if isinstance(last, (ast.Expr, ast.Assign)):
-            lines[last.lineno - 1] = f"{key} = {lines[last.lineno - 1]}"
-        else:
-            lines.append(f"{key} = None")
-        return "\n".join(lines)
+    def produced(self):
+        """ Records the value produced by this node, and registers it as a DuckDB view. """
+        cache_keys[self.key] = self.cache_key
+        tracker.produced(self.key, self.inputs, self.cache_key)
+        database.register(self.key, state[self.key])
 
 def publish(topic, data):
     """ Publishes data to the main process. """
-    polyscript.xworker.sync.publish("Worker", "Main", topic, data)
+    polyscript.xworker.sync.publish(WORKER, "Main", topic, data)
+
+
+def queue_preview(key, cache_key, value, view):
+    """
+    Queues the preview of a node. Previews of visible nodes are rendered in the
+    background once no nodes are running. Previews of nodes that are not visible
+    are only rendered when the main thread requests them.
+    """
+    visible = view.get("visible", True)
+    previews.pop(key, None)
+    previews[key] = (cache_key, value if visible else MISSING, view)
+    if visible:
+        global preview_task # pylint: disable=global-statement
+        if preview_task is None or preview_task.done():
+            preview_task = asyncio.ensure_future(render_previews())
+
+
+def get_value(key, cache_key):
+    """
+    Returns the value of a node from the state or the cache, or MISSING.
+    """
+    value = MISSING
+    if cache_keys.get(key) == cache_key:
+        value = state.get(key, MISSING)
+    if value is MISSING and cache_key in cache.entries:
+        value = cache.entries[cache_key][0]
+    return value
+
+
+def render_preview(key, cache_key, view, value=MISSING):
+    """
+    Renders the preview of a node for the size of its view on the main thread,
+    stores it in the cache and publishes it.
+    """
+    if value is MISSING:
+        value = get_value(key, cache_key)
+    if value is MISSING:
+        result_preview = "<i>The value is no longer available, run the node to see it.</i>"
+    else:
+        result_preview = preview.create_preview(value, view)
+        cache.set_preview(cache_key, result_preview)
+    publish("preview", [key, transport.to_js(result_preview)])
+
+
+async def render_previews():
+    """
+    Renders the queued previews of visible nodes, with a lower priority than running nodes.
+    """
+    while True:
+        await asyncio.sleep(0)
+        if any(not task.done() for task in tasks.values()):
+            await asyncio.sleep(0.01)
+            continue
+        visible = [key for key, (_cache_key, value, _view) in previews.items() if value is not MISSING]
+        if not visible:
+            return
+        cache_key, value, view = previews.pop(visible[0])
+        if cache_keys.get(visible[0]) == cache_key:
+            render_preview(visible[0], cache_key, view, value)
+
+
+def handle_preview(key, view):
+    """
+    Renders the preview of a node the main thread wants to show.
+    """
+    if key in previews:
+        cache_key, value, _view = previews.pop(key)
+        render_preview(key, cache_key, view, value)
+    elif key in cache_keys:
+        render_preview(key, cache_keys[key], view)
+
+
+def handle_expand(key, path, offset):
+    """
+    Renders the part of a tree preview that was left out, starting at the given
+    item of the container at path inside the value of the node.
+    """
+    value = get_value(key, cache_keys.get(key))
+    if value is MISSING:
+        html = "<i>The value is no longer available, run the node to see it.</i>"
+    else:
+        html = preview.get_tree_preview(value, path, offset)
+    publish("expanded", [key, path, offset, html])
+
+
+def handle_rows(key, start, count, columns=None):
+    """
+    Sends a page of rows of the value of a node to the table viewer.
+    The row count of a value is computed once, for its first page, and a
+    DuckDB relation is paged through a snapshot, so the pages do not overlap.
+    """
+    cache_key = cache_keys.get(key)
+    value = get_value(key, cache_key)
+    try:
+        if value is MISSING:
+            raise ValueError("The value is no longer available, run the node to see it.")
+        if preview.get_type_name(value) == "duckdb.DuckDBPyRelation":
+            value = database.snapshot(value, key, cache_key)
+        page = rows.get_rows(value, start, count, columns, row_counts.get(cache_key))
+        row_counts[cache_key] = page["total"]
+        page["error"] = ""
+    except Exception as e: # pylint: disable=broad-except
+        page = {"error": str(e), "start": start}
+    publish("rows", [key, transport.to_js(page, always=True)])
+
+
+def publish_memory():
+    """
+    Reports the values released from the state and the bytes held per node.
+    """
+    evicted = tracker.take_evicted()
+    for key in evicted:
+        database.unregister(key)
+    database.collect(set(cache.entries) | set(cache_keys.values()))
+    if evicted:
+        publish("evicted", [WORKER, evicted])
+    publish("memory", tracker.get_sizes())
+
+
+def handle_settings(request):
+    """
+    Changes the memory budget of the result cache, the keep mode of the state
+    and the size and time budgets of previews, configures the shared DuckDB
+    connection and the HTTP cache, and reports the cache statistics.
+    """
+    settings = json.loads(request)
+    if settings.get("budget"):
+        cache.set_budget(int(settings["budget"]))
+    if settings.get("keep"):
+        tracker.keep = settings["keep"]
+    if settings.get("preview_bytes"):
+        preview.settings["max_bytes"] = int(settings["preview_bytes"])
+    if settings.get("preview_ms"):
+        preview.settings["max_ms"] = int(settings["preview_ms"])
+    if settings.get("http_ttl"):
+        fetch.settings["ttl"] = int(settings["http_ttl"])
+    if settings.get("http_max_bytes"):
+        fetch.settings["max_bytes"] = int(settings["http_max_bytes"])
+    database.configure(
+        settings.get("duckdb_memory"),
+        settings.get("duckdb_threads"),
+        None if settings.get("duckdb_spill") is None else settings["duckdb_spill"] != "false",
+    )
+    publish("cache", dict(cache.stats(), previews=preview.get_timings()))
+
+
+def handle_delete(key):
+    """
+    Evicts the value of a deleted node and drops its DuckDB views.
+    """
+    tracker.delete(key)
+    code_cache.delete(key)
+    database.delete(key)
+    row_counts.pop(cache_keys.pop(key, None), None)
+    publish_memory()
+
+
+def handle_pin(key, pinned):
+    """
+    Pins or unpins the value of a node in the state.
+    """
+    tracker.pin(key, pinned)
+    publish_memory()
+
+
+def handle_options():
+    """
+    Introspects the flows package for node options. The placeholder modules
+    used for the introspection are removed again, so they do not leak into
+    the state used to run nodes.
+    """
+    publish("options", catalog.collect_options(catalog.import_flows()))
+
+
+def handle_send_value(key, target):
+    """
+    Sends the value of a node to another worker that needs it as an input.
+    The value is sent as binary data, see `transport.encode`.
+    """
+    if key not in state and key in cache_keys:
+        entry = cache.get(cache_keys[key])
+        if entry:
+            state[key] = entry[0]
+    payload = None
+    if key in state:
+        try:
+            payload = transport.to_js(transport.encode(state[key]))
+        except Exception as e: # pylint: disable=broad-except
+            print(f"Cannot send the value of {key}: {e}")
+    publish("value", [key, target, cache_keys.get(key) if payload else None, payload])
+
+
+async def handle_receive_value(key, cache_key, payload):
+    """
+    Stores the value of a node that ran on another worker. Publishes "lost"
+    when the value could not be sent or decoded, so the node runs again.
+    """
+    try:
+        if payload is None:
+            raise ValueError(f"The value of {key} could not be sent")
+        if payload["format"] == "arrow":
+            await loader.ensure(["pyarrow"])
+        value = transport.decode(payload)
+    except Exception as e: # pylint: disable=broad-except
+        print(f"Cannot receive the value of {key}: {e}")
+        publish("lost", [key, WORKER])
+        return
+    state[key] = value
+    cache_keys[key] = cache_key
+    tracker.produced(key, tracker.inputs.get(key, []), cache_key)
+    database.register(key, state[key])
+    publish("received", [key, WORKER])
+
+
+def register_values():
+    """
+    Registers the values produced before DuckDB was loaded, so SQL nodes can read them by name.
+    """
+    for key in list(cache_keys):
+        if key in state:
+            database.register(key, state[key])
+
+
+async def run_node(entry, generation, upstream):
+    """
+    Runs a node once the nodes it depends on have completed and the packages
+    it declares are loaded. Returns whether the node produced a result.
+    """
+    defaults = [None, "", [], False, [], {}]
+    key, script, inputs, force, packages, view = list(entry) + defaults[len(entry):]
+    loading = asyncio.ensure_future(loader.ensure(packages))
+    results = await asyncio.gather(*upstream, return_exceptions=True)
+    if not all(result is True for result in results):
+        if generations[key] == generation:
+            publish("skipped", key)
+        return False
+    try:
+        await loading
+        if "duckdb" in packages and database.state["connection"] is None:
+            database.get_connection()
+            register_values()
+    except Exception as e: # pylint: disable=broad-exception-caught
+        publish("error", [key, f"Cannot load packages {', '.join(packages)}: {e}"])
+        return False
+    await asyncio.sleep(0) # handle newer requests first, they may supersede this run
+    if generations[key] != generation:
+        return False
+    return bool(await Runner(key, script, inputs, force, view).run(generation))
+
+
+def run_batch(plan):
+    """
+    Schedules an ordered plan of nodes, publishing each result as it completes.
+
+    Each node runs as a task that waits for its inputs, so independent async nodes
+    overlap. A new plan cancels the pending runs of the nodes it contains, and
+    results of superseded runs are discarded. Nodes that depend on a node that
+    failed are skipped. The inputs of all nodes are recorded before any node runs,
+    so a value read by several nodes in the batch is kept until all of them ran.
+    """
+    for entry in plan:
+        tracker.plan(entry[0], entry[2])
+    batch = []
+    for entry in plan:
+        key, _script, inputs = entry[:3]
+        if key in tasks and not tasks[key].done():
+            tasks[key].cancel()
+        generations[key] += 1
+        upstream = [tasks[input_key] for input_key in inputs if input_key in tasks]
+        tasks[key] = asyncio.ensure_future(run_node(entry, generations[key], upstream))
+        batch.append(tasks[key])
+    asyncio.ensure_future(finish_batch(batch))
 
 
-def handle_request(_sender, _topic, request):
+async def finish_batch(batch):
+    """
+    Reports the memory held by the worker once a batch has completed.
+    """
+    await asyncio.gather(*batch, return_exceptions=True)
+    publish_memory()
+
+
+def handle_request(_sender, topic, request):
     """
     Handles requests received by the worker process.
     """
-    Runner(*json.loads(request)).run()
+    if topic == "settings":
+        handle_settings(request)
+    elif topic == "delete":
+        handle_delete(json.loads(request))
+    elif topic == "pin":
+        handle_pin(*json.loads(request))
+    elif topic == "run_batch":
+        run_batch(json.loads(request))
+    elif topic == "send_value":
+        handle_send_value(*json.loads(request))
+    elif topic == "receive_value":
+        request = json.loads(request) if isinstance(request, str) else transport.to_py(request)
+        asyncio.ensure_future(handle_receive_value(*request))
+    elif topic == "options":
+        handle_options()
+    elif topic == "preview":
+        handle_preview(*json.loads(request))
+    elif topic == "expand":
+        handle_expand(*json.loads(request))
+    elif topic == "rows":
+        handle_rows(*json.loads(request))
+    elif topic == "prefetch":
+        loader.prefetch(json.loads(request))
+    else:
+        run_batch([json.loads(request)])
 
 
 polyscript.xworker.sync.handler = handle_request
-polyscript.xworker.sync.subscribe("Worker", "run", "pyodide-runner")
+for worker_topic in TOPICS:
+    polyscript.xworker.sync.subscribe(WORKER, worker_topic, WORKER)
+
+async def start():
+    """
+    Loads the HTTP cache kept by earlier sessions, then reports that the worker is ready.
+    """
+    try:
+        await fetch.mount()
+    except Exception as e: # pylint: disable=broad-exception-caught
+        print("Cannot mount the HTTP cache:", e)
+    publish("ready", WORKER)
+    loader.prefetch()
+
 
-publish("ready", "")
+asyncio.ensure_future(start())
@@ -0,0 +1,127 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module keeps the worker state bounded by tracking which nodes still
+need the values produced by other nodes.
+"""
+
+from worker.cache import get_size
+
+
+class StateTracker():
+    """
+    Reference counts the node values held in the worker state.
+
+    A value is released once all of its consumers have read it, unless the
+    node is a leaf or pinned. In the default "consumers" mode, released values
+    stay available in the bounded result cache. In the "leaves" mode, they are
+    also dropped from the cache, so only leaves and pinned nodes are kept.
+    """
+
+    def __init__(self, state, cache, keep="consumers"):
+        self.state = state
+        self.cache = cache
+        self.keep = keep
+        self.inputs = {}
+        self.planned = {}
+        self.pending = {}
+        self.pinned = set()
+        self.evicted = []
+
+    def get_consumers(self, key):
+        """
+        Returns the nodes that read the value of the given node, including
+        the nodes that are about to run for the first time.
+        """
+        consumers = [consumer for consumer, inputs in self.inputs.items() if key in inputs]
+        consumers += [
+            consumer
+            for consumer, inputs in self.planned.items()
+            if key in inputs and consumer not in consumers
+        ]
+        return consumers
+
+    def plan(self, key, inputs):
+        """
+        Records the inputs of a node that is about to run, so a value it reads is
+        not released before it ran, even when it never produced a value before.
+        """
+        self.planned[key] = list(inputs)
+
+    def produced(self, key, inputs, cache_key):
+        """
+        Records that a node produced a new value from the given inputs.
+        """
+        superseded = set(self.inputs.get(key, [])) - set(inputs)
+        self.inputs[key] = list(inputs)
+        self.planned.pop(key, None)
+        self.pending[key] = (set(self.get_consumers(key)), cache_key)
+        for input_key in list(superseded) + list(inputs):
+            self.release(input_key, key)
+
+    def restored(self, key, consumer, cache_key):
+        """
+        Records that a released value was restored from the cache for a consumer.
+        """
+        self.pending[key] = ({consumer}, cache_key)
+
+    def release(self, key, consumer):
+        """
+        Records that a consumer no longer needs the value of the given node.
+        """
+        if key not in self.pending:
+            return
+        consumers, cache_key = self.pending[key]
+        consumers.discard(consumer)
+        if consumers or key in self.pinned or not self.get_consumers(key):
+            return
+        self.free(key)
+        if self.keep == "leaves":
+            self.cache.discard(cache_key)
+
+    def free(self, key):
+        """
+        Removes the value of the given node from the worker state.
+        """
+        self.pending.pop(key, None)
+        if self.state.pop(key, None) is not None:
+            self.evicted.append(key)
+
+    def delete(self, key):
+        """
+        Evicts the value of a deleted node and forgets its connections.
+        """
+        _consumers, cache_key = self.pending.get(key, (None, None))
+        self.free(key)
+        self.cache.discard(cache_key)
+        self.planned.pop(key, None)
+        inputs = self.inputs.pop(key, [])
+        for input_key in inputs:
+            self.release(input_key, key)
+
+    def pin(self, key, pinned=True):
+        """
+        Pins a node, so its value is kept in the state.
+        """
+        if pinned:
+            self.pinned.add(key)
+        else:
+            self.pinned.discard(key)
+            self.release(key, None)
+
+    def take_evicted(self):
+        """
+        Returns and clears the keys of the values evicted since the last call.
+        """
+        evicted, self.evicted = self.evicted, []
+        return evicted
+
+    def get_sizes(self):
+        """
+        Returns the approximate number of bytes held for each node in the state.
+        """
+        return {
+            key: get_size(self.state[key])
+            for key in self.inputs
+            if key in self.state
+        }
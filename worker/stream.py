@@ -0,0 +1,88 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module reads CSV files incrementally, as Arrow record batches.
+
+A stream only holds its location, its schema and its first batch, so a node
+that produces one finishes, and can be previewed, after reading one block.
+Every consumer reopens the source and reads it batch by batch, so memory
+stays bounded by the block size, however large the file is.
+"""
+
+from worker import fetch
+from worker import preview
+
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def open_source(url):
+    """
+    Opens a local file or a URL as a binary file object that is read on demand.
+    URLs are read from the response while they download, and are stored in the
+    HTTP cache once read to their end, see `fetch.open_stream`.
+
+    Args:
+        url (str): A local path or an http(s):// URL.
+
+    Returns:
+        A binary file object.
+    """
+    if "://" not in url:
+        return open(url, "rb") # pylint: disable=consider-using-with
+    return fetch.open_stream(url)
+
+
+class CsvStream():
+    """
+    A CSV source that is read as a stream of Arrow record batches.
+    """
+
+    def __init__(self, url, block_size=BLOCK_SIZE):
+        self.url = url
+        self.block_size = block_size
+        self.schema = None
+        self.first = None
+        for batch in self.batches():
+            self.first = batch
+            break
+
+    def batches(self):
+        """
+        Reads the source from the start, yielding one record batch per block.
+        """
+        import pyarrow.csv # pylint: disable=import-error disable=import-outside-toplevel
+        with open_source(self.url) as source:
+            reader = pyarrow.csv.open_csv(
+                source,
+                read_options=pyarrow.csv.ReadOptions(block_size=self.block_size),
+            )
+            self.schema = reader.schema
+            yield from reader
+
+    def to_reader(self):
+        """
+        Returns a pyarrow RecordBatchReader that streams the source from the start.
+        """
+        import pyarrow # pylint: disable=import-error disable=import-outside-toplevel
+        return pyarrow.RecordBatchReader.from_batches(self.schema, self.batches())
+
+
+def get_preview(stream, _view=None):
+    """
+    Previews a CSV stream from its first batch, without reading the rest of the
+    source, and without converting the batch to pandas.
+    """
+    if stream.first is None:
+        return f"<i>{stream.url} is empty</i>"
+    batch = stream.first
+    columns = batch.schema.names
+    types = [str(kind) for kind in batch.schema.types]
+    summary = f"<div class='preview-summary'>CSV stream: first {batch.num_rows:,} rows of {stream.url}</div>"
+
+    def render(rows):
+        sample = [tuple(row.values()) for row in batch.slice(0, rows).to_pylist()]
+        more = [[None] * len(columns)] if batch.num_rows > rows else []
+        return summary + preview.get_html_table(columns, types, sample + more)
+
+    return preview.fit(render, preview.settings["rows"], preview.settings["max_bytes"]) or summary
@@ -0,0 +1,141 @@
+"""
+CopyRight (c) 2024 - Chris Laffra - All Rights Reserved.
+
+This module encodes node values so they can be sent between workers.
+"""
+
+import io
+import pickle
+import sys
+
+from worker.preview import get_type_name
+
+
+def get_table_kind(value):
+    """
+    Returns "pandas" or "duckdb" for tabular values that can be sent as Arrow, or None.
+    """
+    type_name = get_type_name(value)
+    if type_name == "pandas.DataFrame":
+        return "pandas"
+    if type_name == "duckdb.DuckDBPyRelation":
+        return "duckdb"
+    return None
+
+
+def to_arrow(value, kind):
+    """
+    Converts a DataFrame or DuckDB relation to a pyarrow Table. DuckDB produces
+    Arrow natively, without going through pandas.
+    """
+    import pyarrow # pylint: disable=import-error disable=import-outside-toplevel
+    if kind == "duckdb":
+        return value.fetch_arrow_table()
+    return pyarrow.Table.from_pandas(value, preserve_index=True)
+
+
+def from_arrow(table, kind):
+    """
+    Converts a pyarrow Table back to the kind of value it was created from.
+    Columns are converted to pandas without keeping a second copy of the table.
+    """
+    if kind == "duckdb":
+        import duckdb # pylint: disable=import-error disable=import-outside-toplevel
+        return duckdb.arrow(table)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def encode(value):
+    """
+    Encodes a value so it can be sent over pub/sub as binary data.
+
+    DataFrames and DuckDB relations are encoded as an Arrow IPC stream, when
+    pyarrow is installed. The stream is returned as a view on the Arrow buffer,
+    without copying it. Without pyarrow, relations are pickled as a DataFrame,
+    as a relation cannot be pickled. Other values are pickled.
+
+    Args:
+        value: The value to encode.
+
+    Returns:
+        dict: The format of the payload, the kind of value and the data.
+    """
+    kind = get_table_kind(value)
+    try:
+        import pyarrow # pylint: disable=import-error disable=import-outside-toplevel
+    except ImportError:
+        pyarrow = None
+    if kind and pyarrow:
+        table = to_arrow(value, kind)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return {"format": "arrow", "kind": kind, "data": memoryview(sink.getvalue())}
+    if kind == "duckdb":
+        value = value.df()
+    return {"format": "pickle", "kind": kind, "data": pickle.dumps(value)}
+
+
+def decode(payload):
+    """
+    Decodes a value that was encoded with `encode`.
+
+    Args:
+        payload (dict): The encoded value.
+
+    Returns:
+        The decoded value.
+    """
+    if payload["format"] == "arrow":
+        import pyarrow # pylint: disable=import-error disable=import-outside-toplevel
+        table = pyarrow.ipc.open_stream(pyarrow.py_buffer(payload["data"])).read_all()
+        return from_arrow(table, payload["kind"])
+    value = pickle.load(io.BytesIO(payload["data"]))
+    if payload["kind"] == "duckdb":
+        import duckdb # pylint: disable=import-error disable=import-outside-toplevel
+        return duckdb.from_df(value)
+    return value
+
+
+def to_py(value):
+    """
+    Converts a JavaScript value received over pub/sub to Python. Typed arrays
+    become memoryviews, so the bytes are not copied again.
+    """
+    if hasattr(value, "to_py"):
+        return value.to_py()
+    return value
+
+
+def to_js(value, always=False):
+    """
+    Converts a value that holds bytes to JavaScript, so the bytes cross the
+    worker boundary as a Uint8Array instead of a copied string. Other values
+    are returned unchanged, as they are converted by pub/sub.
+
+    Args:
+        value: The value to convert.
+        always (bool): Convert the value even when it holds no bytes, so the
+            receiver always gets plain JavaScript objects.
+
+    Returns:
+        The converted value.
+    """
+    if sys.platform != "emscripten" or not (always or has_bytes(value)):
+        return value
+    import js # pylint: disable=import-error disable=import-outside-toplevel
+    import pyodide.ffi # pylint: disable=import-error disable=import-outside-toplevel
+    return pyodide.ffi.to_js(value, dict_converter=js.Object.fromEntries)
+
+
+def has_bytes(value, depth=3):
+    """
+    Returns whether a value is, or contains, bytes, up to the given nesting depth.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return True
+    if depth and isinstance(value, dict):
+        return any(has_bytes(item, depth - 1) for item in value.values())
+    if depth and isinstance(value, (list, tuple)):
+        return any(has_bytes(item, depth - 1) for item in value)
+    return False